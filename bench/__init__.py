@@ -0,0 +1,41 @@
+import math
+import time
+import random
+import heapq
+
+class SensorStream(object):
+    """
+    Generates a deterministic, time-ordered stream of synthetic sensor
+    readings as (t, topic, value) tuples.
+
+    Each topic reports every `interval` seconds (+/- `jitter` seconds) over
+    `days` days ending at `end`, with values following a slow daily sine
+    wave plus noise, roughly like a room temperature sensor.
+    """
+
+    def __init__(self, topics=20, interval=60, jitter=5, days=3, end=None, seed=0):
+        self.interval = interval
+        self.jitter = jitter
+        self.days = days
+        self.end = end if end is not None else math.floor(time.time())
+        self.start = self.end - (days * 24 * 60 * 60)
+        self.seed = seed
+        self.topics = ['xiaomi_mijia/SENSOR_{:03d}/temperature'.format(i) for i in range(topics)]
+
+    def _topic_readings(self, index, topic):
+        rng = random.Random('{}:{}'.format(self.seed, index))
+        baseline = 18 + rng.random() * 6
+        phase = rng.random() * 2 * math.pi
+
+        t = self.start + rng.random() * self.interval
+        while t < self.end:
+            value = baseline + 3 * math.sin((2 * math.pi * t / 86400) + phase) + rng.gauss(0, 0.2)
+            yield (t, topic, round(value, 2))
+            t += self.interval + rng.uniform(-self.jitter, self.jitter)
+
+    def __iter__(self):
+        # merge the per-topic streams so readings arrive in time order
+        return heapq.merge(*[self._topic_readings(i, topic) for (i, topic) in enumerate(self.topics)])
+
+    def __len__(self):
+        return sum(1 for _ in self)
@@ -0,0 +1,268 @@
+"""
+Reproducible benchmark for sensor_logging.
+
+Generates a synthetic sensor stream, drives DatabaseHandler both directly and
+through the HTTP/queue path used in production, and writes the results to a
+JSON file so runs can be compared between commits:
+
+    python3 -m bench --output bench_output.json
+    python3 -m bench --compare bench_output.json --output new.json
+"""
+import os
+import json
+import time
+import math
+import queue
+import socket
+import logging
+import argparse
+import platform
+import resource
+import sqlite3
+import tempfile
+import threading
+import multiprocessing
+import subprocess
+import urllib.request
+from urllib.parse import urlencode
+
+from sensor_logging import DatabaseHandler, HttpServer, QueryWorker
+from bench import SensorStream
+
+class MockS3Client(object):
+    """Stands in for boto3's S3 client, recording what would be uploaded."""
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Body, Bucket, Key):
+        self.objects['{}/{}'.format(Bucket, Key)] = len(Body)
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    if not samples:
+        return None
+    k = (len(samples) - 1) * (p / 100.0)
+    lower = math.floor(k)
+    upper = math.ceil(k)
+    if lower == upper:
+        return samples[int(k)]
+    return samples[lower] + (samples[upper] - samples[lower]) * (k - lower)
+
+def summarize(samples):
+    return {
+        'n': len(samples),
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+        'max_ms': max(samples) * 1000
+    }
+
+def rss_kb():
+    # current RSS from /proc where available, falling back to the peak
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * (os.sysconf('SC_PAGE_SIZE') // 1024)
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def query_shapes(stream):
+    day = 24 * 60 * 60
+    return {
+        'one_topic_24h_1m': {'topic': stream.topics[:1], 'chunk': [60], 'since': [stream.end - day]},
+        'one_topic_full_1h': {'topic': stream.topics[:1], 'chunk': [60 * 60], 'since': [stream.start]},
+        'all_topics_24h_5m': {'topic': stream.topics, 'chunk': [5 * 60], 'since': [stream.end - day]},
+        'all_topics_1h_1m': {'topic': stream.topics, 'chunk': [60], 'since': [stream.end - (60 * 60)]}
+    }
+
+def reset(db):
+    db.conn.execute('DELETE FROM data')
+    db.conn.commit()
+
+def bench_direct(db, stream, args, results):
+    reset(db)
+
+    readings = list(stream)
+    start = time.perf_counter()
+    for (t, topic, value) in readings:
+        db.insert(topic, value, t)
+    elapsed = time.perf_counter() - start
+    results['insert'] = {
+        'rows': len(readings),
+        'seconds': elapsed,
+        'rows_per_second': len(readings) / elapsed
+    }
+    results['rss_kb']['after_insert'] = rss_kb()
+
+    results['time_series'] = {}
+    for (name, qsparams) in query_shapes(stream).items():
+        samples = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            db.handle_time_series(qsparams)
+            samples.append(time.perf_counter() - start)
+        results['time_series'][name] = summarize(samples)
+    results['rss_kb']['after_time_series'] = rss_kb()
+
+    db.s3_client = MockS3Client()
+    interval = math.floor(stream.end / db.S3_INTERVAL)
+    start = time.perf_counter()
+    db.write_to_s3(interval)
+    results['write_to_s3'] = {
+        'seconds': time.perf_counter() - start,
+        'bytes': sum(db.s3_client.objects.values())
+    }
+    results['rss_kb']['after_write_to_s3'] = rss_kb()
+
+    start = time.perf_counter()
+    db.flush_to_disk()
+    results['flush'] = {
+        'seconds': time.perf_counter() - start,
+        'bytes': os.path.getsize(db.filename)
+    }
+
+    # drop everything older than one day so trim has real work to do
+    start = time.perf_counter()
+    db.trim_database(since=stream.end - (24 * 60 * 60))
+    results['trim'] = {'seconds': time.perf_counter() - start}
+    results['rss_kb']['after_trim'] = rss_kb()
+
+def start_worker(worker_rx, worker_tx, config):
+    worker = QueryWorker(worker_rx, worker_tx, MockS3Client(), config)
+    worker.loop()
+
+def bench_http(stream, config, filename, args, results):
+    db_rx = queue.Queue()
+    db_tx = queue.Queue()
+    ready = threading.Event()
+
+    # mirror __main__: with worker processes, queries go to them instead
+    query_rx = db_rx
+    query_tx = db_tx
+    if args.workers > 0:
+        config = dict(config, SNAPSHOT_PATH=filename + '.snapshot', SNAPSHOT_INTERVAL=1)
+        query_rx = multiprocessing.Queue()
+        query_tx = multiprocessing.Queue()
+        for i in range(args.workers):
+            multiprocessing.Process(target=start_worker, args=(query_rx, query_tx, config), daemon=True).start()
+
+    # like __main__.start_db, the handler must be created on the thread that uses it
+    def start_db():
+        db = DatabaseHandler(db_rx, db_tx, MockS3Client(), config, filename)
+        reset(db)
+        ready.set()
+        db.loop()
+
+    # keep per-request access logging out of the timings and the output
+    HttpServer.MyHttpRequestHandler.log_message = lambda *args: None
+
+    port = free_port()
+    httpd = HttpServer(port, db_rx, db_tx, query_rx=query_rx, query_tx=query_tx)
+    threading.Thread(target=start_db, daemon=True).start()
+    threading.Thread(target=httpd.start, daemon=True).start()
+    ready.wait()
+
+    # queue-driven ingest, as MQTTHandler.on_message would do it
+    readings = list(stream)
+    start = time.perf_counter()
+    for (i, (t, topic, value)) in enumerate(readings):
+        db_rx.put(((i, 'insert'), (topic, value, t)))
+    db_rx.join()
+    elapsed = time.perf_counter() - start
+    results['queue_insert'] = {
+        'rows': len(readings),
+        'seconds': elapsed,
+        'rows_per_second': len(readings) / elapsed
+    }
+
+    # give the workers a snapshot that includes everything just inserted
+    if args.workers > 0:
+        time.sleep(config['SNAPSHOT_INTERVAL'] * 2)
+
+    results['http_time_series'] = {}
+    for (name, qsparams) in query_shapes(stream).items():
+        url = 'http://127.0.0.1:{}/time-series?{}'.format(port, urlencode(qsparams, doseq=True))
+        samples = []
+        for _ in range(args.http_repeat):
+            start = time.perf_counter()
+            with urllib.request.urlopen(url, timeout=30) as response:
+                response.read()
+            samples.append(time.perf_counter() - start)
+        results['http_time_series'][name] = summarize(samples)
+    results['rss_kb']['after_http'] = rss_kb()
+
+def compare(baseline, current, path=()):
+    # print numeric values that moved by more than 10%
+    for (key, value) in current.items():
+        if key not in baseline:
+            continue
+        if isinstance(value, dict) and isinstance(baseline[key], dict):
+            compare(baseline[key], value, path + (key,))
+        elif isinstance(value, (int, float)) and isinstance(baseline[key], (int, float)) and baseline[key]:
+            change = (value - baseline[key]) / baseline[key]
+            if abs(change) >= 0.1:
+                print('{:<50} {:>14.3f} -> {:>14.3f} ({:+.0%})'.format('.'.join(path + (key,)), baseline[key], value, change))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python3 -m bench', description='Benchmark sensor_logging against a synthetic sensor load')
+    parser.add_argument('--topics', type=int, default=20, help='number of sensor topics')
+    parser.add_argument('--interval', type=float, default=60, help='seconds between readings per topic')
+    parser.add_argument('--jitter', type=float, default=5, help='max +/- seconds of jitter per reading')
+    parser.add_argument('--days', type=float, default=3, help='days of data to generate')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=50, help='direct query repetitions per shape')
+    parser.add_argument('--http-repeat', type=int, default=20, help='HTTP query repetitions per shape')
+    parser.add_argument('--skip-http', action='store_true')
+    parser.add_argument('--workers', type=int, default=0, help='answer HTTP queries from this many QueryWorker processes')
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+
+    # a fixed end time keeps the generated data identical between runs
+    end = math.floor(time.time() / 86400) * 86400
+    stream = SensorStream(topics=args.topics, interval=args.interval, jitter=args.jitter, days=args.days, end=end, seed=args.seed)
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'machine': platform.machine(),
+            'params': vars(args)
+        },
+        'rss_kb': {'start': rss_kb()}
+    }
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        config = {'RETENTION_PERIOD': math.ceil(args.days + 1) * 24 * 60 * 60}
+        db = DatabaseHandler(queue.Queue(), queue.Queue(), None, config, os.path.join(tempdir, 'bench.db'))
+        bench_direct(db, stream, args, results)
+        if not args.skip_http:
+            bench_http(stream, config, os.path.join(tempdir, 'bench_http.db'), args, results)
+
+    results['rss_kb']['peak'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+    print('wrote {}'.format(args.output))
+
+if __name__ == '__main__':
+    main()
@@ -4,11 +4,8 @@ set -eu -o pipefail
 
 USER=pi
 HOST='192.168.1.2'
-JSONS="$(ssh ${USER}@${HOST} 'find /home/${USER}/sensor_logging -type f -name *.json | grep -v \.venv | sort -r')"
-rm -f /tmp/xmas.csv
-TAIL_CMD=""
-for j in $JSONS; do
-    ssh ${USER}@${HOST} "cd $(dirname ${j}) && python3 /home/${USER}/sensor_logging/csvify.py ${j} ${TAIL_CMD}" | xsv select 1,10,11 | tr ',' '\t' >> /tmp/xmas.csv
-    TAIL_CMD="| tail -n+2"
-done
+JSONS="$(ssh ${USER}@${HOST} 'find /home/${USER}/sensor_logging -type f -name *.json | grep -v \.venv')"
+
+# csvify merges every file into one time-sorted CSV in a single pass
+ssh ${USER}@${HOST} "python3 /home/${USER}/sensor_logging/csvify.py ${JSONS//$'\n'/ }" | xsv select 1,10,11 | tr ',' '\t' > /tmp/xmas.csv
 pbcopy < /tmp/xmas.csv
@@ -13,13 +13,22 @@ import queue
 import socketserver
 import logging
 import http.server
+import cProfile
+import pstats
+import tracemalloc
+import tempfile
+import hashlib
+import email.utils
 from urllib.parse import urlparse, parse_qs
-from collections import defaultdict
+from collections import defaultdict, deque
 from statistics import median
 from datetime import datetime
 
 import paho.mqtt.client as mqtt
 
+from sensor_logging.archive import Archive, DirectorySource, S3Source, add_bucket
+from sensor_logging import columnar
+
 class MQTTHandler(object):
     def __init__(self, queue, host, redis_client):
         self.queue = queue
@@ -38,7 +47,8 @@ class MQTTHandler(object):
         self.client.subscribe('aq/#')
 
     def on_message(self, client, userdata, msg):
-        self.queue.put(((str(uuid.uuid4()), 'insert'), (msg.topic, msg.payload)))
+        # stamp readings on arrival so they keep their time if the DB thread is busy restoring
+        self.queue.put(((str(uuid.uuid4()), 'insert'), (msg.topic, msg.payload, time.time())))
 
         if self.redis_client:
             self.redis_client.set(msg.topic, msg.payload.decode("utf-8"))
@@ -46,9 +56,65 @@ class MQTTHandler(object):
 
         logging.debug('MQTT message: {} - {}'.format(msg.topic, msg.payload.decode('utf-8')))
 
-class DatabaseHandler(object):
+class LazyClient(object):
+    """
+    Defers building a client until an attribute is first used, so slow
+    imports (boto3 in particular) don't hold up startup.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return getattr(self._client, name)
+
+class TaskError(Exception):
+    """
+    Sent back on tx_queue in place of a result when a task fails, so the
+    HTTP server can answer with an error status instead of timing out.
+    """
+
+    def __init__(self, status, message):
+        # both go in args so the error survives pickling across processes
+        super().__init__(status, message)
+        self.status = status
+        self.message = message
+
+    @classmethod
+    def from_exception(cls, e):
+        # bad query parameters show up as ValueErrors while parsing them
+        if isinstance(e, ValueError):
+            return cls(400, 'bad request: {}'.format(e))
+        return cls(500, 'error handling request: {}'.format(e))
 
-    def __init__(self, rx_queue, tx_queue, s3_client, config = {}, filename = False):
+class DatabaseHandler(object):
+    # with MEMORY_LIMIT set, the database is shrunk once it uses this
+    # fraction of the limit, until it's back under the lower one
+    MEMORY_HIGH_WATER = 0.9
+    MEMORY_LOW_WATER = 0.75
+
+    # how many AGGREGATION_INTERVAL buckets to downsample or trim per step
+    MEMORY_STEP_BUCKETS = 12
+
+    # where enforce_memory_limit keeps downsampled readings; t is REAL so
+    # whole-second times aren't stored as integers and bucketed by integer
+    # division, and total and count let buckets be combined by weight
+    AGGREGATES_SQL = """
+        CREATE TABLE aggregates (
+            t REAL,
+            topic TEXT,
+            total REAL,
+            count INTEGER
+        )
+        """
+
+    def __init__(self, rx_queue, tx_queue, s3_client, config = {}, filename = False, export_queue = None):
         self.filename = filename
         self.s3_client = s3_client
         self.last_s3_upload = None
@@ -56,18 +122,13 @@ class DatabaseHandler(object):
         self.tx_queue = tx_queue
         self.conn = sqlite3.connect('file:sensor_logging?mode=memory&cache=shared', uri=True)
 
-        self.db_lock = threading.Lock()
-        self.s3_lock = threading.Lock()
+        # when set, daily S3 exports are handed to a QueryWorker process
+        self.export_queue = export_queue
 
-        self.TRIM_INTERVAL = config.get('TRIM_INTERVAL', 60 * 60)
-        self.FLUSH_INTERVAL = config.get('FLUSH_INTERVAL', 8 * 60 * 60)
-        self.AGGREGATION_INTERVAL = config.get('AGGREGATION_INTERVAL', 5 * 60)
-        self.S3_INTERVAL = config.get('S3_INTERVAL', 24 * 60 * 60)
-        self.RETENTION_PERIOD = config.get('RETENTION_PERIOD', 7 * 24 * 60 * 60)
-        self.S3_BUCKET = config.get('S3_BUCKET', 'sbma44')
-        self.S3_PATH = config.get('S3_PATH', '137t/sensors/environment/')
+        self.configure(config)
+        self.apply_pragmas()
 
-        if filename and os.path.exists(self.filename):
+        if filename and os.path.exists(self.filename) and not self.FAST_START:
             # open existing file
             source = sqlite3.connect(self.filename)
             source.backup(self.conn)
@@ -94,12 +155,97 @@ class DatabaseHandler(object):
             finally:
                 self.db_lock.release()
 
+        # only created once something has been downsampled
+        self.has_aggregates = self.table_exists('aggregates')
+
+        if filename and os.path.exists(self.filename) and self.FAST_START:
+            # restore the on-disk database a chunk at a time from the loop
+            # instead, so inserts can start right away
+            self.start_restore()
+
+    def configure(self, config):
+        self.db_lock = threading.Lock()
+        self.s3_lock = threading.Lock()
+
+        self.TRIM_INTERVAL = config.get('TRIM_INTERVAL', 60 * 60)
+        self.FLUSH_INTERVAL = config.get('FLUSH_INTERVAL', 8 * 60 * 60)
+        self.AGGREGATION_INTERVAL = config.get('AGGREGATION_INTERVAL', 5 * 60)
+        self.S3_INTERVAL = config.get('S3_INTERVAL', 24 * 60 * 60)
+        self.RETENTION_PERIOD = config.get('RETENTION_PERIOD', 7 * 24 * 60 * 60)
+        self.S3_BUCKET = config.get('S3_BUCKET', 'sbma44')
+        self.S3_PATH = config.get('S3_PATH', '137t/sensors/environment/')
+        self.SLOW_QUERY_THRESHOLD = config.get('SLOW_QUERY_THRESHOLD', 1.0)
+        self.FAST_START = config.get('FAST_START', False)
+        self.RESTORE_CHUNK = config.get('RESTORE_CHUNK', 10000)
+        self.RESTORE_NEWEST_FIRST = config.get('RESTORE_NEWEST_FIRST', True)
+        self.SNAPSHOT_PATH = config.get('SNAPSHOT_PATH', None)
+        self.SNAPSHOT_INTERVAL = config.get('SNAPSHOT_INTERVAL', 15)
+        self.COLUMNAR_EXPORT = config.get('COLUMNAR_EXPORT', False)
+        self.MEMORY_LIMIT = config.get('MEMORY_LIMIT', None)
+        self.MEMORY_CHECK_INTERVAL = config.get('MEMORY_CHECK_INTERVAL', 60)
+        self.MEMORY_KEEP_RAW = config.get('MEMORY_KEEP_RAW', 2 * self.S3_INTERVAL)
+        self.SQLITE_PAGE_SIZE = config.get('SQLITE_PAGE_SIZE', None)
+        self.SQLITE_CACHE_SIZE = config.get('SQLITE_CACHE_SIZE', None)
+
+        # queries reaching past RETENTION_PERIOD are answered from the daily exports when configured
+        self.archive = self.make_archive(config, self.s3_client)
+
+        # most recent time-series queries that took longer than SLOW_QUERY_THRESHOLD
+        self.slow_queries = deque(maxlen=100)
+
+        # set while an on-demand profile of the loop is running
+        self.profiler = None
+        self.profile_task = None
+
+        # (source connection, pending (start, end) rowid partitions) while a fast-start restore is underway
+        self.restore_source = None
+        self.restore_partitions = []
+
+        # whether anything has changed since the last snapshot
+        self.dirty = True
+
+        # used to build time-series ETags: inserts bump their topic's version,
+        # anything that can change every topic (trims, restores) bumps the
+        # generation, and the epoch keeps versions from before a restart
+        # from matching ones after it
+        self.epoch = str(uuid.uuid4())
+        self.generation = 0
+        self.write_seq = 0
+        self.topic_versions = {}
+        self.topic_last_write = {}
+
+        # everything before this has been downsampled into the aggregates
+        # table to stay within MEMORY_LIMIT
+        self.downsampled_until = None
+        self.has_aggregates = False
+
+    @staticmethod
+    def make_archive(config, s3_client):
+        # also used by HttpServer, which fetches the archived days a query
+        # needs before handing it over
+        archive_dir = config.get('ARCHIVE_DIR', None)
+        if not (archive_dir or config.get('ARCHIVE_FROM_S3', False)):
+            return None
+
+        source = DirectorySource(archive_dir) if archive_dir else S3Source(s3_client, config.get('S3_BUCKET', 'sbma44'))
+        return Archive(
+            source,
+            config.get('ARCHIVE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'sensor_logging_archive')),
+            config.get('S3_PATH', '137t/sensors/environment/'),
+            config.get('S3_INTERVAL', 24 * 60 * 60),
+            config.get('ARCHIVE_CACHE_DAYS', 366),
+            config.get('ARCHIVE_MAX_DAYS', 366),
+            config.get('COLUMNAR_EXPORT', False)
+        )
+
     def loop(self, until=False):
 
         current_interval = math.floor(time.time() / self.S3_INTERVAL)
         last_s3_upload = current_interval
         last_flush = time.time()
         last_trim = time.time()
+        last_snapshot = None
+        last_memory_check = time.time()
 
         # until exists to facilitate testing
         while (until is False) or (time.time() < until):
@@ -117,13 +263,34 @@ class DatabaseHandler(object):
                 self.trim_database()
                 last_trim = current_time
 
+            # check to see if the database is outgrowing its memory budget
+            if self.MEMORY_LIMIT and current_time - last_memory_check >= self.MEMORY_CHECK_INTERVAL:
+                self.enforce_memory_limit()
+                last_memory_check = current_time
+
+            # check to see if worker processes need a fresher snapshot
+            if self.SNAPSHOT_PATH and self.dirty and (last_snapshot is None or current_time - last_snapshot >= self.SNAPSHOT_INTERVAL):
+                self.snapshot()
+                last_snapshot = current_time
+
             # check to see if we need to upload to S3
             current_interval = math.floor(time.time() / self.S3_INTERVAL)
             if current_interval > last_s3_upload:
-                logging.info('writing to S3')
-                self.write_to_s3(current_interval)
+                if self.export_queue is not None:
+                    logging.info('handing S3 export to a worker')
+                    self.finish_restore()
+                    self.snapshot()
+                    last_snapshot = current_time
+                    self.export_queue.put(((str(uuid.uuid4()), 'export'), current_interval))
+                else:
+                    logging.info('writing to S3')
+                    self.write_to_s3(current_interval)
                 last_s3_upload = current_interval
 
+            # check to see if a requested profile has run its course
+            if self.profiler is not None and current_time >= self.profile_task[1]:
+                self.tx_queue.put((self.profile_task[0], self.stop_profile()))
+
             try:
                 # Try to get a task from the queue without blocking
                 task = self.rx_queue.get(block=False)
@@ -133,7 +300,7 @@ class DatabaseHandler(object):
                 payload = task[1]
 
                 if (task_type == 'insert'):
-                    self.insert(payload[0], payload[1])
+                    self.insert(*payload)
                     self.rx_queue.task_done()
 
                 elif (task_type == 'query'):
@@ -141,35 +308,223 @@ class DatabaseHandler(object):
                     self.tx_queue.put((task_id, result))
                     self.rx_queue.task_done()
 
+                elif (task_type == 'time_series'):
+                    result = self.handle_cached_time_series(*payload)
+                    self.tx_queue.put((task_id, result))
+                    self.rx_queue.task_done()
+
                 elif (task_type == 'ping'):
                     self.tx_queue.put((task_id, 'pong'))
                     self.rx_queue.task_done()
 
+                elif (task_type == 'profile'):
+                    self.start_profile(task_id, payload)
+                    self.rx_queue.task_done()
+
+                elif (task_type == 'slow_queries'):
+                    self.tx_queue.put((task_id, list(self.slow_queries)))
+                    self.rx_queue.task_done()
+
+                elif (task_type == 'memory'):
+                    self.tx_queue.put((task_id, self.memory_usage()))
+                    self.rx_queue.task_done()
+
             except queue.Empty:
-                # No task available, rest a bit and continue
-                time.sleep(0.1)
+                # No task available; use the time to restore history if
+                # there's any left, otherwise rest a bit and continue
+                if self.restore_partitions:
+                    self.restore_step()
+                else:
+                    time.sleep(0.1)
                 continue
 
-    def insert(self, topic, value):
+            except Exception as e:
+                # keep the loop alive, and tell whoever is waiting what went wrong
+                logging.exception('error handling {} task: {}'.format(task_type, e))
+                if task_type != 'insert':
+                    self.tx_queue.put((task_id, TaskError.from_exception(e)))
+                self.rx_queue.task_done()
+
+    def start_restore(self):
+        if self.oldest_time() is not None:
+            logging.warning('in-memory database already populated; not restoring from {}'.format(self.filename))
+            return
+
+        source = sqlite3.connect(self.filename)
+
+        # downsampled readings are few, so they're restored in one go
+        try:
+            aggregates = source.execute('SELECT t, topic, total, count FROM aggregates').fetchall()
+        except sqlite3.OperationalError:
+            aggregates = []
+        if aggregates:
+            self.db_lock.acquire()
+            try:
+                self.create_aggregates()
+                self.conn.executemany('INSERT INTO aggregates (t, topic, total, count) VALUES (?, ?, ?, ?)', aggregates)
+                self.conn.commit()
+                self.generation += 1
+            finally:
+                self.db_lock.release()
+
+        # data has no index on t, so page through it by rowid instead, which
+        # costs a seek per partition rather than a scan. Rows are appended
+        # (roughly) in time order, so descending rowid is newest first.
+        try:
+            rowid_min = source.execute('SELECT MIN(rowid) FROM data').fetchone()[0]
+            rowid_max = source.execute('SELECT MAX(rowid) FROM data').fetchone()[0]
+        except sqlite3.OperationalError:
+            rowid_min = None
+
+        if rowid_min is None:
+            source.close()
+            return
+
+        partitions = []
+        start = rowid_min
+        while start <= rowid_max:
+            partitions.append((start, start + self.RESTORE_CHUNK))
+            start += self.RESTORE_CHUNK
+
+        # restore_step pops from the end of the list
+        if not self.RESTORE_NEWEST_FIRST:
+            partitions.reverse()
+
+        logging.info('restoring {} partitions from {}'.format(len(partitions), self.filename))
+        self.restore_source = source
+        self.restore_partitions = partitions
+
+    def restore_step(self):
+        (start, end) = self.restore_partitions.pop()
+        rows = self.restore_source.execute('SELECT t, topic, value FROM data WHERE rowid >= ? AND rowid < ?', (start, end)).fetchall()
+
+        self.db_lock.acquire()
+        try:
+            cur = self.conn.cursor()
+            cur.executemany('INSERT INTO data (t, topic, value) VALUES (?, ?, ?)', rows)
+            self.conn.commit()
+            self.dirty = True
+            self.generation += 1
+        finally:
+            self.db_lock.release()
+
+        if not self.restore_partitions:
+            logging.info('restore from {} complete'.format(self.filename))
+            self.restore_source.close()
+            self.restore_source = None
+
+    def finish_restore(self):
+        # anything that reads the whole database (or overwrites the file
+        # being restored from) needs the restore to be complete first
+        while self.restore_partitions:
+            self.restore_step()
+
+    def insert(self, topic, value, t=None):
+        # t defaults to now; callers replaying buffered or synthetic readings
+        # can supply the original timestamp
+        if t is None:
+            t = time.time()
+
         self.db_lock.acquire()
         try:
             cur = self.conn.cursor()
-            cur.execute('INSERT INTO data (t, topic, value) VALUES (?, ?, ?)',  (time.time(), topic, value))
+            cur.execute('INSERT INTO data (t, topic, value) VALUES (?, ?, ?)',  (t, topic, value))
             self.conn.commit()
+            self.dirty = True
+            self.write_seq += 1
+            self.topic_versions[topic] = self.write_seq
+            self.topic_last_write[topic] = time.time()
         finally:
             self.db_lock.release()
 
     def handle_time_series(self, qsparams):
+        start = time.perf_counter()
+        out = self.query_time_series(qsparams)
+        elapsed = time.perf_counter() - start
+
+        if self.SLOW_QUERY_THRESHOLD is not None and elapsed >= self.SLOW_QUERY_THRESHOLD:
+            logging.warning('slow time-series query ({:.3f}s): {}'.format(elapsed, qsparams))
+            self.record_slow_query({'t': time.time(), 'seconds': elapsed, 'params': qsparams})
+
+        return out
+
+    def record_slow_query(self, record):
+        self.slow_queries.append(record)
+
+    def handle_cached_time_series(self, qsparams, if_none_match=None):
+        """
+        Serves /time-series for HTTP clients: returns (etag, last_modified,
+        data), where data is None if if_none_match shows the client already
+        has the current result, in which case no query is run.
+
+        since is snapped down to the edge of its bucket so that clients
+        polling with a sliding window share results (and ETags) until a new
+        bucket starts, and since_bucket limits the result to that bucket
+        (typically the client's last, possibly incomplete one) and newer.
+        """
+        topics = [topic.strip() for topic in qsparams.get('topic', ['xiaomi_mijia/M_BKROOM/temperature'])]
+        chunk = int(qsparams.get('chunk', [60])[0])
+        until = float(qsparams.get('until', [False])[0])
+        since_bucket = float(qsparams.get('since_bucket', [0])[0])
+
+        # since is only passed on when the client set one, as leaving it out
+        # is what keeps queries away from the archive
+        since = None
+        if 'since' in qsparams:
+            # buckets are round(t / chunk), so bucket b starts at (b - 0.5) * chunk
+            since = (math.floor((float(qsparams['since'][0]) / chunk) + 0.5) - 0.5) * chunk
+        if since_bucket:
+            since = max(since or 0, since_bucket - (chunk / 2))
+
+        params = {'topic': topics, 'chunk': [chunk]}
+        if since is not None:
+            params['since'] = [since]
+        if until:
+            params['until'] = [until]
+
+        (version, last_modified) = self.time_series_version(topics)
+        key = json.dumps([self.epoch, version, sorted(params.items())])
+        etag = '"{}"'.format(hashlib.sha1(key.encode('utf-8')).hexdigest()[:20])
+
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            if etag in tags or '*' in tags:
+                return (etag, last_modified, None)
+
+        out = self.handle_time_series(params)
+        if since_bucket:
+            out = {topic: [row for row in rows if row[0] >= since_bucket] for (topic, rows) in out.items()}
+        return (etag, last_modified, out)
+
+    def time_series_version(self, topics):
+        # something that changes whenever a query for these topics could return different data
+        version = [self.generation] + [self.topic_versions.get(topic, 0) for topic in topics]
+        if self.archive is not None:
+            # federated queries split at a cutoff that moves with the clock
+            version.append(math.floor(time.time() / self.TRIM_INTERVAL))
+
+        last_writes = [self.topic_last_write[topic] for topic in topics if topic in self.topic_last_write]
+        return (version, max(last_writes) if last_writes else None)
+
+    def query_time_series(self, qsparams):
         topics = qsparams.get('topic', ['xiaomi_mijia/M_BKROOM/temperature'])
         chunk = int(qsparams.get('chunk', [60])[0])
         since = float(qsparams.get('since', [24 * 60 * 60])[0])
         until = float(qsparams.get('until', [False])[0])
 
+        # anything older than this has been trimmed from memory; the archive
+        # is only consulted when the client explicitly asks for older data
+        cutoff = time.time() - self.RETENTION_PERIOD
+        if self.archive is not None and 'since' in qsparams and since < cutoff:
+            return self.query_federated([topic.strip() for topic in topics], chunk, since, until, cutoff)
+
         out = {}
         for (i, topic) in enumerate(topics):
             topic = topic.strip()
 
-            sql = "SELECT (round(t / ?) * ?), AVG(value) FROM data WHERE topic = ?"
+            # downsampled buckets are weighted by how many readings went into them
+            columns = "SUM(value), COUNT(value)" if self.has_aggregates else "AVG(value)"
+            sql = "SELECT (round(t / ?) * ?), {} FROM data WHERE topic = ?".format(columns)
             params = [chunk, chunk, topic]
             if since:
                 sql += " AND t > ?"
@@ -184,9 +539,226 @@ class DatabaseHandler(object):
             cursor.execute(sql, params)
 
             out[topic] = cursor.fetchall()
+            if self.has_aggregates:
+                buckets = {}
+                for (bucket, total, count) in out[topic]:
+                    add_bucket(buckets, bucket, total, count)
+                self.add_downsampled_buckets(buckets, topic, chunk, since, until)
+                out[topic] = [(bucket, total / count) for (bucket, (total, count)) in sorted(buckets.items())]
 
         return out
 
+    def query_federated(self, topics, chunk, since, until, cutoff):
+        # the archive holds AGGREGATION_INTERVAL medians rather than raw
+        # readings, so buckets are combined by sum and count rather than
+        # averaged separately
+        window = self.archive.window(since, until, cutoff)
+        if window is not None:
+            archived = self.archive.buckets(topics, chunk, *window)
+        else:
+            archived = {topic: {} for topic in topics}
+
+        out = {}
+        for topic in topics:
+            out[topic] = self.merge_recent_buckets(archived[topic], topic, chunk, until, cutoff)
+        return out
+
+    def merge_recent_buckets(self, buckets, topic, chunk, until, cutoff):
+        # adds the in-memory database's buckets from cutoff on to the archived ones
+        if not until or until > cutoff:
+            sql = "SELECT (round(t / ?) * ?), SUM(value), COUNT(value) FROM data WHERE topic = ? AND t >= ?"
+            params = [chunk, chunk, topic, cutoff]
+            if until:
+                sql += " AND t < ?"
+                params.append(until)
+            sql += " GROUP BY round(t / ?)"
+            params.append(chunk)
+
+            cursor = self.conn.cursor()
+            for (bucket, total, count) in cursor.execute(sql, params):
+                add_bucket(buckets, bucket, total, count)
+            self.add_downsampled_buckets(buckets, topic, chunk, cutoff, until)
+
+        return [(bucket, total / count) for (bucket, (total, count)) in sorted(buckets.items())]
+
+    def add_downsampled_buckets(self, buckets, topic, chunk, since, until):
+        # adds readings downsampled by enforce_memory_limit to {bucket: [sum, count]}
+        if not self.has_aggregates:
+            return
+
+        sql = "SELECT (round(t / ?) * ?), SUM(total), SUM(count) FROM aggregates WHERE topic = ?"
+        params = [chunk, chunk, topic]
+        if since:
+            sql += " AND t > ?"
+            params.append(since)
+        if until:
+            sql += " AND t < ?"
+            params.append(until)
+        sql += " GROUP BY round(t / ?)"
+        params.append(chunk)
+
+        cursor = self.conn.cursor()
+        for (bucket, total, count) in cursor.execute(sql, params):
+            add_bucket(buckets, bucket, total, count)
+
+    def start_profile(self, task_id, params):
+        # profile the loop itself for the requested number of seconds; the
+        # report is sent back on tx_queue once the time is up
+        if self.profiler is not None:
+            self.tx_queue.put((task_id, TaskError(409, 'a profile is already running')))
+            return
+
+        seconds = float(params.get('seconds', 10))
+        self.profile_task = (task_id, time.time() + seconds, params.get('sort', 'cumulative'), int(params.get('limit', 40)))
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def stop_profile(self):
+        self.profiler.disable()
+        (task_id, until, sort, limit) = self.profile_task
+
+        report = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=report)
+        stats.sort_stats(sort).print_stats(limit)
+
+        self.profiler = None
+        self.profile_task = None
+        return report.getvalue()
+
+    def apply_pragmas(self):
+        # page_size only takes effect on a database that hasn't been created
+        # yet; a backup restored into it brings the source's page size along
+        cur = self.conn.cursor()
+        if self.SQLITE_PAGE_SIZE:
+            cur.execute('PRAGMA page_size = {}'.format(int(self.SQLITE_PAGE_SIZE)))
+        if self.SQLITE_CACHE_SIZE is not None:
+            cur.execute('PRAGMA cache_size = {}'.format(int(self.SQLITE_CACHE_SIZE)))
+
+    def memory_usage(self):
+        cur = self.conn.cursor()
+        page_size = cur.execute('PRAGMA page_size').fetchone()[0]
+        page_count = cur.execute('PRAGMA page_count').fetchone()[0]
+        freelist_count = cur.execute('PRAGMA freelist_count').fetchone()[0]
+        cache_size = cur.execute('PRAGMA cache_size').fetchone()[0]
+
+        # deleted rows leave their pages on the freelist, still allocated but
+        # reused by later inserts, so used_bytes is what counts against the limit
+        return {
+            'page_size': page_size,
+            'page_count': page_count,
+            'freelist_count': freelist_count,
+            'cache_size': cache_size,
+            'allocated_bytes': page_count * page_size,
+            'used_bytes': (page_count - freelist_count) * page_size,
+            'limit_bytes': self.MEMORY_LIMIT
+        }
+
+    def enforce_memory_limit(self):
+        """
+        Shrinks the database once it nears MEMORY_LIMIT: first by downsampling
+        the oldest raw readings (see downsample_step), leaving the last
+        MEMORY_KEEP_RAW seconds, which the next S3 export still needs,
+        untouched, and then by trimming the oldest data before
+        RETENTION_PERIOD would.
+        """
+        used = self.memory_usage()['used_bytes']
+        logging.debug('database is using {} of {} bytes'.format(used, self.MEMORY_LIMIT))
+        if used < self.MEMORY_LIMIT * self.MEMORY_HIGH_WATER:
+            return
+
+        # restored rows would land amid downsampled ones, so wait for it to finish
+        if self.restore_partitions:
+            logging.info('database near its memory limit; waiting for restore to finish before shrinking it')
+            return
+
+        target = self.MEMORY_LIMIT * self.MEMORY_LOW_WATER
+        keep_raw_since = time.time() - self.MEMORY_KEEP_RAW
+
+        while used >= target and self.downsample_step(keep_raw_since):
+            used = self.memory_usage()['used_bytes']
+        if used < target:
+            logging.info('downsampled data older than {} to stay within the memory limit'.format(datetime.fromtimestamp(self.downsampled_until).isoformat()))
+            return
+
+        since = None
+        while used >= target:
+            oldest = self.oldest_time()
+            if oldest is None or oldest >= keep_raw_since:
+                break
+            since = min(oldest + (self.MEMORY_STEP_BUCKETS * self.AGGREGATION_INTERVAL), keep_raw_since)
+            self.trim_database(since=since)
+            used = self.memory_usage()['used_bytes']
+
+        if since is not None:
+            logging.warning('memory limit reached: trimmed data older than {} early'.format(datetime.fromtimestamp(since).isoformat()))
+        if used >= target:
+            logging.error('database is using {} bytes, over its {} byte memory limit, with only the last MEMORY_KEEP_RAW seconds left; raise MEMORY_LIMIT'.format(used, self.MEMORY_LIMIT))
+
+    def downsample_step(self, before):
+        """
+        Moves the raw readings in the next few buckets after downsampled_until
+        into the aggregates table as one (sum, count) row per topic per bucket,
+        returning False once there's nothing left to do before `before`.
+
+        Buckets are half an AGGREGATION_INTERVAL wide and start on multiples
+        of that, so each one lies entirely within a single /time-series bucket
+        for any chunk that's a multiple of AGGREGATION_INTERVAL, and weighting
+        by count leaves those buckets' averages unchanged.
+        """
+        width = self.AGGREGATION_INTERVAL / 2
+        oldest = self.conn.execute('SELECT MIN(t) FROM data').fetchone()[0]
+        if oldest is None:
+            return False
+
+        start = math.floor(oldest / width) * width
+        if self.downsampled_until is not None:
+            start = max(start, self.downsampled_until)
+        end = min(start + (self.MEMORY_STEP_BUCKETS * self.AGGREGATION_INTERVAL), math.floor(before / width) * width)
+        if end <= start:
+            return False
+
+        self.db_lock.acquire()
+        try:
+            self.create_aggregates()
+            cur = self.conn.cursor()
+
+            # width is a float, so t / width isn't integer division; rows are
+            # stored at their bucket's centre
+            sql = """
+                SELECT (CAST(t / ? AS INTEGER) + 0.5) * ?, topic, SUM(value), COUNT(value) FROM data
+                WHERE t >= ? AND t < ?
+                GROUP BY CAST(t / ? AS INTEGER), topic"""
+            rows = cur.execute(sql, (float(width), width, start, end, float(width))).fetchall()
+            cur.execute('DELETE FROM data WHERE t >= ? AND t < ?', (start, end))
+            cur.executemany('INSERT INTO aggregates (t, topic, total, count) VALUES (?, ?, ?, ?)', rows)
+            self.conn.commit()
+            self.dirty = True
+            self.generation += 1
+        finally:
+            self.db_lock.release()
+
+        self.downsampled_until = end
+        return True
+
+    def create_aggregates(self):
+        # callers hold db_lock
+        if not self.has_aggregates:
+            self.conn.execute(self.AGGREGATES_SQL)
+            self.has_aggregates = True
+
+    def table_exists(self, name):
+        cur = self.conn.cursor()
+        cur.execute("SELECT count(name) FROM sqlite_master WHERE type='table' AND name=?", (name,))
+        return cur.fetchone()[0] == 1
+
+    def oldest_time(self):
+        oldest = self.conn.execute('SELECT MIN(t) FROM data').fetchone()[0]
+        if self.has_aggregates:
+            oldest_aggregate = self.conn.execute('SELECT MIN(t) FROM aggregates').fetchone()[0]
+            if oldest is None or (oldest_aggregate is not None and oldest_aggregate < oldest):
+                oldest = oldest_aggregate
+        return oldest
+
     def trim_database(self, since=None):
         logging.info('trimming database')
 
@@ -197,31 +769,53 @@ class DatabaseHandler(object):
         try:
             cur = self.conn.cursor()
             cur.execute("DELETE FROM data WHERE t < ?", (since,))
+            deleted = cur.rowcount
+            if self.has_aggregates:
+                cur.execute("DELETE FROM aggregates WHERE t < ?", (since,))
+                deleted += cur.rowcount
+            if deleted > 0:
+                self.dirty = True
+                self.generation += 1
             self.conn.commit()
         finally:
             self.db_lock.release()
 
     def flush_to_disk(self):
-        # save in-memory database to disk
-        if os.path.exists('{}.tmp'.format(self.filename)):
-            os.remove('{}.tmp'.format(self.filename))
+        self.finish_restore()
 
+        # save in-memory database to disk
         logging.info('attempting to store database to disk ({})'.format(self.filename))
         if self.filename:
-            self.db_lock.acquire()
-            try:
-                dest = sqlite3.connect('{}.tmp'.format(self.filename))
-                with dest:
-                    self.conn.backup(dest)
-                dest.close()
-            except Exception as e:
-                logging.error('error storing database to disk: {}'.format(e))
-            finally:
-                self.db_lock.release()
-            shutil.move('{}.tmp'.format(self.filename), self.filename)
+            self.backup_to(self.filename)
+
+    def snapshot(self):
+        # refresh the read-only copy that QueryWorker processes query
+        logging.debug('writing snapshot ({})'.format(self.SNAPSHOT_PATH))
+        self.backup_to(self.SNAPSHOT_PATH)
+        self.dirty = False
+
+    def backup_to(self, filename):
+        # copy via a temporary file so readers never see a partial database
+        tmp_filename = '{}.tmp'.format(filename)
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
 
+        self.db_lock.acquire()
+        try:
+            dest = sqlite3.connect(tmp_filename)
+            with dest:
+                self.conn.backup(dest)
+            dest.close()
+        except Exception as e:
+            logging.error('error storing database to disk: {}'.format(e))
+            return
+        finally:
+            self.db_lock.release()
+        shutil.move(tmp_filename, filename)
 
     def write_to_s3(self, interval = None):
+        self.finish_restore()
+
         self.s3_lock.acquire()
 
         if interval is None:
@@ -296,6 +890,12 @@ class DatabaseHandler(object):
             json_gz = gzip.compress(json_output.read().encode('utf-8'))
             self.s3_client.put_object(Body=json_gz, Bucket=self.S3_BUCKET, Key='{}sensor_logging_{}.json.gz'.format(self.S3_PATH, date_string))
 
+            # upload columnar
+            if self.COLUMNAR_EXPORT:
+                t = [period_start + (i * self.AGGREGATION_INTERVAL) for i in range(len(csv_rows))]
+                columns = {topic: [row.get(topic) for row in csv_rows] for topic in topics}
+                self.s3_client.put_object(Body=columnar.dumps(t, columns), Bucket=self.S3_BUCKET, Key='{}sensor_logging_{}{}'.format(self.S3_PATH, date_string, columnar.EXTENSION))
+
             # Close the StringIO object
             csv_output.close()
             json_output.close()
@@ -313,80 +913,301 @@ class DatabaseHandler(object):
     def __del__(self):
         self.close()
 
+class QueryWorker(DatabaseHandler):
+    """
+    Answers queries and runs S3 exports in a separate process, reading from
+    the snapshot the writer's DatabaseHandler keeps at SNAPSHOT_PATH, so CPU
+    heavy work (JSON encoding, medians, gzip) doesn't compete with ingest for
+    the GIL.
+    """
+
+    def __init__(self, rx_queue, tx_queue, s3_client, config = {}):
+        self.filename = False
+        self.s3_client = s3_client
+        self.rx_queue = rx_queue
+        self.tx_queue = tx_queue
+        self.export_queue = None
+        self.conn = None
+        self.snapshot_version = None
+
+        self.configure(config)
+
+    def refresh(self):
+        # reopen the snapshot if the writer has replaced it since we last looked
+        try:
+            stat = os.stat(self.SNAPSHOT_PATH)
+        except FileNotFoundError:
+            return
+        version = (stat.st_ino, stat.st_mtime_ns)
+
+        if version != self.snapshot_version:
+            if self.conn is not None:
+                self.conn.close()
+            self.conn = sqlite3.connect('file:{}?mode=ro'.format(self.SNAPSHOT_PATH), uri=True)
+            self.apply_pragmas()
+            self.has_aggregates = self.table_exists('aggregates')
+            self.snapshot_version = version
+
+    def loop(self, until=False):
+        while (until is False) or (time.time() < until):
+            try:
+                task = self.rx_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            # None asks the worker to exit
+            if task is None:
+                break
+
+            (task_id, task_type) = task[0]
+            payload = task[1]
+
+            # a worker is alive whether or not it has anything to query yet
+            if (task_type == 'ping'):
+                self.tx_queue.put((task_id, 'pong'))
+                continue
+
+            self.refresh()
+            if self.conn is None:
+                logging.warning('no snapshot at {} yet; refusing {} task'.format(self.SNAPSHOT_PATH, task_type))
+                self.tx_queue.put((task_id, TaskError(503, 'no database snapshot available yet')))
+                continue
+
+            try:
+                if (task_type == 'query'):
+                    # encode here rather than in the HTTP thread of the ingest process
+                    result = json.dumps(self.handle_time_series(payload)).encode('utf-8')
+                    self.tx_queue.put((task_id, result))
+
+                elif (task_type == 'time_series'):
+                    (etag, last_modified, data) = self.handle_cached_time_series(*payload)
+                    if data is not None:
+                        data = json.dumps(data).encode('utf-8')
+                    self.tx_queue.put((task_id, (etag, last_modified, data)))
+
+                elif (task_type == 'export'):
+                    self.write_to_s3(payload)
+
+                elif (task_type == 'memory'):
+                    # the snapshot is a page-for-page copy of the writer's database
+                    self.tx_queue.put((task_id, self.memory_usage()))
+
+                else:
+                    self.tx_queue.put((task_id, TaskError(501, 'not available with worker processes: {}'.format(task_type))))
+
+            except Exception as e:
+                # keep the worker alive; exports have nobody waiting on them
+                logging.exception('error handling {} task: {}'.format(task_type, e))
+                if task_type != 'export':
+                    self.tx_queue.put((task_id, TaskError.from_exception(e)))
+
+        # the connection belongs to this thread, so close it here
+        self.close()
+
+    def record_slow_query(self, record):
+        # each worker only sees its own queries, so they're also sent,
+        # unprompted, to the HTTP server, which keeps the combined log
+        super().record_slow_query(record)
+        self.tx_queue.put((None, ('slow_query', record)))
+
+    def time_series_version(self, topics):
+        # workers can't see the writer's per-topic versions, so any new
+        # snapshot counts as a change to every topic
+        version = [list(self.snapshot_version)]
+        if self.archive is not None:
+            version.append(math.floor(time.time() / self.TRIM_INTERVAL))
+        return (version, self.snapshot_version[1] / 1e9)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+class ThreadedTCPServer(socketserver.ThreadingTCPServer):
+    # don't let in-flight requests hold up shutdown
+    daemon_threads = True
+
 class HttpServer(object):
-    def __init__(self, port, db_rx, db_tx):
+    # how long clients may cache /time-series results for windows entirely in the past
+    CLOSED_WINDOW_MAX_AGE = 5 * 60
+
+    # tasks sent to the query queue; everything else (pings, profiles,
+    # memory reports) goes to the database thread itself
+    QUERY_TASKS = ('query', 'time_series')
+
+    def __init__(self, port, db_rx, db_tx, config = {}, query_rx = None, query_tx = None, s3_client = None):
         self.port = port
         self.db_rx = db_rx
         self.db_tx = db_tx
 
+        # with worker processes, queries go to them instead of the database thread
+        self.query_rx = query_rx if query_rx is not None else db_rx
+        self.query_tx = query_tx if query_tx is not None else db_tx
+
+        # /admin/* profiling endpoints are only served when explicitly enabled
+        self.ADMIN_ENABLED = config.get('ADMIN_ENABLED', False)
+        self.ADMIN_MAX_SECONDS = config.get('ADMIN_MAX_SECONDS', 60)
+        self.WORKER_PROCESSES = config.get('WORKER_PROCESSES', 0)
+        self.RETENTION_PERIOD = config.get('RETENTION_PERIOD', 7 * 24 * 60 * 60)
+
+        # archived days are downloaded on the request's thread, so a long
+        # historical query doesn't hold up the database thread
+        self.archive = DatabaseHandler.make_archive(config, s3_client)
+
+        # slow queries reported by worker processes
+        self.slow_queries = deque(maxlen=100)
+
+        # requests are handled on their own threads, so responses from the
+        # DB are routed back to whichever request is waiting for them
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+
+        # only one tracemalloc report can run at a time
+        self.tracemalloc_lock = threading.Lock()
+
     def start(self):
-        with socketserver.TCPServer(("", self.port), self.handler_factory) as httpd:
+        threading.Thread(target=self.dispatch_responses, args=(self.db_tx,), daemon=True).start()
+        if self.query_tx is not self.db_tx:
+            threading.Thread(target=self.dispatch_responses, args=(self.query_tx,), daemon=True).start()
+
+        # threaded, so a long-running admin request doesn't stall dashboard polls
+        with ThreadedTCPServer(("", self.port), self.handler_factory) as httpd:
             logging.info("Server started at localhost:" + str(self.port))
             httpd.serve_forever()
 
+    def db_request(self, task_type, payload, timeout=10):
+        task_id = str(uuid.uuid4())
+        response = queue.Queue(maxsize=1)
+
+        self.pending_lock.acquire()
+        try:
+            self.pending[task_id] = response
+        finally:
+            self.pending_lock.release()
+
+        rx_queue = self.query_rx if task_type in self.QUERY_TASKS else self.db_rx
+        rx_queue.put(((task_id, task_type), payload))
+        try:
+            result = response.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        finally:
+            self.pending_lock.acquire()
+            try:
+                del self.pending[task_id]
+            finally:
+                self.pending_lock.release()
+
+        if isinstance(result, TaskError):
+            raise result
+        return result
+
+    def prefetch_archive(self, qsparams):
+        # mirrors DatabaseHandler.query_time_series: only an explicit since
+        # older than what's in memory reaches the archive
+        if self.archive is None or 'since' not in qsparams:
+            return
+        try:
+            # handle_cached_time_series may move since back by up to a chunk
+            since = float(qsparams['since'][0]) - int(qsparams.get('chunk', [60])[0])
+            until = float(qsparams.get('until', [False])[0])
+        except ValueError:
+            # left for the query to reject
+            return
+
+        window = self.archive.window(since, until, time.time() - self.RETENTION_PERIOD)
+        if window is not None:
+            self.archive.prefetch(*window)
+
+    def dispatch_responses(self, tx_queue):
+        while True:
+            (task_id, result) = tx_queue.get()
+
+            # messages nobody asked for, from worker processes
+            if task_id is None:
+                (kind, record) = result
+                if kind == 'slow_query':
+                    self.slow_queries.append(record)
+                continue
+
+            self.pending_lock.acquire()
+            try:
+                response = self.pending.get(task_id)
+            finally:
+                self.pending_lock.release()
+
+            # responses to requests that already timed out are dropped
+            if response is None:
+                logging.warning('discarding stale DB response {}'.format(task_id))
+                continue
+            response.put(result)
+
     # Define a factory function to create instances of MyHttpRequestHandler
     def handler_factory(self, *args, **kwargs):
-        return HttpServer.MyHttpRequestHandler(self.db_rx, self.db_tx, *args, **kwargs)
+        return HttpServer.MyHttpRequestHandler(self.db_rx, self.db_tx, *args, httpd=self, **kwargs)
 
     class MyHttpRequestHandler(http.server.SimpleHTTPRequestHandler):
-        def __init__(self, db_rx, db_tx, request, client_address, server):
+        def __init__(self, db_rx, db_tx, request, client_address, server, httpd=None):
             self.db_rx = db_rx
             self.db_tx = db_tx
+            self.httpd = httpd
             super().__init__(request, client_address, server)
 
-        def empty_queue(self, q):
-            while not q.empty():
-                try:
-                    message = q.get_nowait()
-                    q.task_done()
-                except queue.Empty:
-                    break
-
         def do_GET(self):
+            try:
+                self.handle_get()
+            except TaskError as e:
+                self.send_text(e.status, e.message)
+
+        def handle_get(self):
             # Use the existing database connection
             parsed_path = urlparse(self.path)
             path = parsed_path.path
             qsparams = parse_qs(parsed_path.query)
 
+            # queued tasks are left alone here: the queue also buffers incoming
+            # MQTT inserts, which must survive a poll
             if path == '/time-series':
-                self.empty_queue(self.db_rx)
+                if self.httpd is not None:
+                    self.httpd.prefetch_archive(qsparams)
+                response = self.db_request('time_series', (qsparams, self.headers.get('If-None-Match')))
+                if response is None:
+                    return self.send_timeout()
+                (etag, last_modified, data) = response
 
-                task_id = str(uuid.uuid4())
-                self.db_rx.put(((task_id, 'query'), qsparams))
+                # a client's copy is current: skip the body entirely
+                if data is None:
+                    self.send_response(304)
+                    self.send_caching_headers(qsparams, etag, last_modified)
+                    self.end_headers()
+                    return
 
-                try:
-                    response = self.db_tx.get(timeout=10)
-                    if response[0] != task_id:
-                        logging.warn('task ID mismatch')
-                        self.empty_queue(self.db_tx)
-                        self.send_response(500)
-                        self.send_header("Content-type", "text/html")
-                        self.end_headers()
-                        self.wfile.write(b"task ID mismatch")
-                        return
-                    data = response[1]
-                except queue.Empty:
-                    return self.send_timeout()
+                # Prepare the response
+                self.send_response(200)
+                self.send_header("Content-type", "application/json")
+                self.send_caching_headers(qsparams, etag, last_modified)
+                self.end_headers()
+
+                # Send the response; QueryWorker results arrive already encoded
+                if not isinstance(data, bytes):
+                    data = json.dumps(data).encode('utf-8')
+                self.wfile.write(data)
+                return
 
             elif path == '/ping':
-                self.empty_queue(self.db_rx)
+                response = self.db_request('ping', {})
+                if response is None:
+                    return self.send_timeout()
 
-                task_id = str(uuid.uuid4())
-                self.db_rx.put(((task_id, 'ping'), {}))
-                try:
-                    response = self.db_tx.get(timeout=10)
-                    if response[0] != task_id:
-                        logging.warn('task ID mismatch')
-                        self.cleanup_queue(self.db_tx)
+                self.send_response(200)
+                self.send_header("Content-type", "text/html")
+                self.end_headers()
+                self.wfile.write(response.encode('utf-8'))
+                return
 
-                    self.send_response(200)
-                    self.send_header("Content-type", "text/html")
-                    self.end_headers()
-                    self.wfile.write(response[1].encode('utf-8'))
-                    return
+            elif path.startswith('/admin/') and self.httpd is not None and self.httpd.ADMIN_ENABLED:
+                return self.do_admin(path, qsparams)
 
-                except queue.Empty:
-                    return self.send_timeout()
             else:
                 self.send_response(404)
                 self.send_header("Content-type", "text/html")
@@ -394,13 +1215,91 @@ class HttpServer(object):
                 self.wfile.write(b"404 Not Found")
                 return
 
-            # Prepare the response
-            self.send_response(200)
-            self.send_header("Content-type", "application/json")
-            self.end_headers()
+        def send_caching_headers(self, qsparams, etag, last_modified):
+            self.send_header("ETag", etag)
+            if last_modified is not None:
+                self.send_header("Last-Modified", email.utils.formatdate(last_modified, usegmt=True))
+
+            # a window that has already closed only changes when it's trimmed,
+            # so it can be cached outright; anything else must be revalidated
+            # (cheaply, via If-None-Match) on every poll
+            until = float(qsparams.get('until', [0])[0])
+            if until and until < time.time():
+                self.send_header("Cache-Control", "max-age={}".format(HttpServer.CLOSED_WINDOW_MAX_AGE))
+            else:
+                self.send_header("Cache-Control", "no-cache")
 
-            # Send the response
-            self.wfile.write(json.dumps(data).encode('utf-8'))
+        def do_admin(self, path, qsparams):
+            try:
+                seconds = float(qsparams.get('seconds', [10])[0])
+                limit = int(qsparams.get('limit', [40])[0])
+            except ValueError:
+                return self.send_text(400, 'seconds and limit must be numeric')
+            if not (math.isfinite(seconds) and seconds > 0):
+                return self.send_text(400, 'seconds must be a positive number')
+            seconds = min(seconds, self.httpd.ADMIN_MAX_SECONDS)
+
+            if path == '/admin/profile':
+                sort = qsparams.get('sort', ['cumulative'])[0]
+                if sort not in [k.value for k in pstats.SortKey]:
+                    return self.send_text(400, 'unknown sort key: {}'.format(sort))
+
+                response = self.db_request('profile', {'seconds': seconds, 'sort': sort, 'limit': limit}, timeout=seconds + 10)
+                if response is None:
+                    return self.send_timeout()
+                return self.send_text(200, response)
+
+            elif path == '/admin/tracemalloc':
+                if not self.httpd.tracemalloc_lock.acquire(blocking=False):
+                    return self.send_text(409, 'a tracemalloc report is already running')
+                try:
+                    report = self.tracemalloc_report(seconds, limit)
+                finally:
+                    self.httpd.tracemalloc_lock.release()
+                return self.send_text(200, report)
+
+            elif path in ('/admin/slow-queries', '/admin/memory'):
+                if path == '/admin/slow-queries' and self.httpd.WORKER_PROCESSES > 0:
+                    response = list(self.httpd.slow_queries)
+                else:
+                    task_type = {'/admin/slow-queries': 'slow_queries', '/admin/memory': 'memory'}[path]
+                    response = self.db_request(task_type, {})
+                if response is None:
+                    return self.send_timeout()
+                self.send_response(200)
+                self.send_header("Content-type", "application/json")
+                self.end_headers()
+                self.wfile.write(json.dumps(response).encode('utf-8'))
+                return
+
+            return self.send_text(404, '404 Not Found')
+
+        def db_request(self, task_type, payload, timeout=10):
+            return self.httpd.db_request(task_type, payload, timeout)
+
+        def tracemalloc_report(self, seconds, limit):
+            # diff two snapshots taken `seconds` apart across all threads
+            was_tracing = tracemalloc.is_tracing()
+            if not was_tracing:
+                tracemalloc.start()
+            try:
+                before = tracemalloc.take_snapshot()
+                time.sleep(seconds)
+                after = tracemalloc.take_snapshot()
+            finally:
+                if not was_tracing:
+                    tracemalloc.stop()
+
+            lines = ['top {} allocation changes over {:.1f}s'.format(limit, seconds)]
+            for stat in after.compare_to(before, 'lineno')[:limit]:
+                lines.append(str(stat))
+            return '\n'.join(lines) + '\n'
+
+        def send_text(self, code, text):
+            self.send_response(code)
+            self.send_header("Content-type", "text/plain")
+            self.end_headers()
+            self.wfile.write(text.encode('utf-8'))
 
         def send_timeout(self):
             self.send_response(408)
@@ -2,11 +2,31 @@ import os
 import logging
 import threading
 import queue
+import multiprocessing
 
-import boto3
-import redis
+from sensor_logging import DatabaseHandler, HttpServer, MQTTHandler, LazyClient, QueryWorker
+
+# defaults for settings that older local_settings.py files may not define
+ADMIN_ENABLED = False
+SLOW_QUERY_THRESHOLD = 1.0
+FAST_START = False
+RESTORE_NEWEST_FIRST = True
+RESTORE_CHUNK = 10000
+WORKER_PROCESSES = 0
+SNAPSHOT_PATH = '/dev/shm/sensor_logging_snapshot.db'
+SNAPSHOT_INTERVAL = 15
+COLUMNAR_EXPORT = False
+ARCHIVE_DIR = None
+ARCHIVE_FROM_S3 = False
+ARCHIVE_CACHE_DIR = '/var/tmp/sensor_logging_archive'
+ARCHIVE_CACHE_DAYS = 366
+ARCHIVE_MAX_DAYS = 366
+MEMORY_LIMIT = None
+MEMORY_KEEP_RAW = 2 * 24 * 60 * 60
+MEMORY_CHECK_INTERVAL = 60
+SQLITE_PAGE_SIZE = None
+SQLITE_CACHE_SIZE = None
 
-from sensor_logging import DatabaseHandler, HttpServer, MQTTHandler
 from sensor_logging.local_settings import *
 
 log_level = os.getenv('LOG_LEVEL', 'WARNING').upper()
@@ -18,24 +38,37 @@ if not isinstance(numeric_level, int):
 # Example format: "2021-01-01 12:00:00,000 - name - LEVEL - Message"
 logging.basicConfig(level=numeric_level, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
 
-def start_httpd(port, db_rx, db_tx):
-    httpd = HttpServer(port, db_rx, db_tx)
+def start_httpd(port, db_rx, db_tx, config, query_rx, query_tx, s3_client):
+    httpd = HttpServer(port, db_rx, db_tx, config, query_rx, query_tx, s3_client)
     httpd.start()
 
-def start_db(db_rx, db_tx, s3_client, config, filename):
-    db = DatabaseHandler(db_rx, db_tx, s3_client, config, filename)
+def start_db(db_rx, db_tx, s3_client, config, filename, export_queue=None):
+    db = DatabaseHandler(db_rx, db_tx, s3_client, config, filename, export_queue)
     db.loop()
 
+def start_worker(worker_rx, worker_tx, config):
+    worker = QueryWorker(worker_rx, worker_tx, LazyClient(make_s3_client), config)
+    worker.loop()
+
 def start_mqtt(db_rx, mqtt_host, redis_client):
     mqtt = MQTTHandler(db_rx, mqtt_host, redis_client)
 
+# boto3 and redis are slow to import on a Pi, so they're only loaded on first use
+def make_s3_client():
+    import boto3
+    return boto3.client('s3', region_name=AWS_DEFAULT_REGION, aws_access_key_id=AWS_ACCESS_KEY_ID, aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
+
+def make_redis_client():
+    import redis
+    return redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+
 if __name__ == '__main__':
     db_rx = queue.Queue()
     db_tx = queue.Queue()
-    s3_client = boto3.client('s3', region_name=AWS_DEFAULT_REGION, aws_access_key_id=AWS_ACCESS_KEY_ID, aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
+    s3_client = LazyClient(make_s3_client)
     redis_client = None
     if REDIS_HOST:
-        redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+        redis_client = LazyClient(make_redis_client)
 
     config = {
         'TRIM_INTERVAL': TRIM_INTERVAL,
@@ -43,15 +76,50 @@ if __name__ == '__main__':
         'S3_INTERVAL': S3_INTERVAL,
         'RETENTION_PERIOD': RETENTION_PERIOD,
         'S3_BUCKET': S3_BUCKET,
-        'S3_PATH': S3_PATH
+        'S3_PATH': S3_PATH,
+        'SLOW_QUERY_THRESHOLD': SLOW_QUERY_THRESHOLD,
+        'ADMIN_ENABLED': ADMIN_ENABLED,
+        'FAST_START': FAST_START,
+        'RESTORE_NEWEST_FIRST': RESTORE_NEWEST_FIRST,
+        'RESTORE_CHUNK': RESTORE_CHUNK,
+        'COLUMNAR_EXPORT': COLUMNAR_EXPORT,
+        'ARCHIVE_DIR': ARCHIVE_DIR,
+        'ARCHIVE_FROM_S3': ARCHIVE_FROM_S3,
+        'ARCHIVE_CACHE_DIR': ARCHIVE_CACHE_DIR,
+        'ARCHIVE_CACHE_DAYS': ARCHIVE_CACHE_DAYS,
+        'ARCHIVE_MAX_DAYS': ARCHIVE_MAX_DAYS,
+        'WORKER_PROCESSES': WORKER_PROCESSES,
+        'MEMORY_LIMIT': MEMORY_LIMIT,
+        'MEMORY_KEEP_RAW': MEMORY_KEEP_RAW,
+        'MEMORY_CHECK_INTERVAL': MEMORY_CHECK_INTERVAL,
+        'SQLITE_PAGE_SIZE': SQLITE_PAGE_SIZE,
+        'SQLITE_CACHE_SIZE': SQLITE_CACHE_SIZE
     }
 
+    # by default queries and exports run on the database thread; with worker
+    # processes they're answered from a snapshot instead
+    query_rx = db_rx
+    query_tx = db_tx
+    export_queue = None
+    if WORKER_PROCESSES > 0:
+        config['SNAPSHOT_PATH'] = SNAPSHOT_PATH
+        config['SNAPSHOT_INTERVAL'] = SNAPSHOT_INTERVAL
+        query_rx = multiprocessing.Queue()
+        query_tx = multiprocessing.Queue()
+        export_queue = query_rx
+
+        # start these before any threads so forking is safe
+        logging.info('starting {} worker processes'.format(WORKER_PROCESSES))
+        for i in range(WORKER_PROCESSES):
+            worker = multiprocessing.Process(target=start_worker, args=(query_rx, query_tx, config), daemon=True)
+            worker.start()
+
     logging.info('starting database')
-    db_thread = threading.Thread(target=start_db, args=(db_rx, db_tx, s3_client, config, SQLITE_FILENAME), daemon=True)
+    db_thread = threading.Thread(target=start_db, args=(db_rx, db_tx, s3_client, config, SQLITE_FILENAME, export_queue), daemon=True)
     db_thread.start()
 
     logging.info('starting http')
-    http_thread = threading.Thread(target=start_httpd, args=(HTTP_PORT, db_rx, db_tx), daemon=True)
+    http_thread = threading.Thread(target=start_httpd, args=(HTTP_PORT, db_rx, db_tx, config, query_rx, query_tx, s3_client), daemon=True)
     http_thread.start()
 
     logging.info('starting mqtt')
@@ -0,0 +1,248 @@
+import io
+import os
+import gzip
+import json
+import math
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+
+from sensor_logging import columnar
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+def add_bucket(buckets, bucket, total, count):
+    # buckets are {bucket: [sum, count]}, so partial buckets from different
+    # sources combine into a weighted average
+    if bucket in buckets:
+        buckets[bucket][0] += total
+        buckets[bucket][1] += count
+    else:
+        buckets[bucket] = [total, count]
+
+class DirectorySource(object):
+    """Reads daily exports from a local directory, e.g. an `aws s3 sync` mirror."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def get(self, key):
+        # mirrors are flat, so only the file name part of the key matters;
+        # exports kept on the Pi may also have been decompressed to .json
+        filename = os.path.join(self.path, os.path.basename(key))
+        candidates = [filename]
+        if filename.endswith('.gz'):
+            candidates.append(filename[:-len('.gz')])
+
+        for candidate in candidates:
+            if os.path.exists(candidate):
+                with open(candidate, 'rb') as f:
+                    return f.read()
+        return None
+
+class S3Source(object):
+    """Reads daily exports straight from the bucket write_to_s3 uploads to."""
+
+    def __init__(self, s3_client, bucket):
+        self.s3_client = s3_client
+        self.bucket = bucket
+
+    def get(self, key):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=key)
+        except Exception as e:
+            # without s3:ListBucket (which the IAM policy in cfn-template.py
+            # doesn't grant) S3 answers 403 rather than 404 for a missing key
+            code = getattr(e, 'response', {}).get('Error', {}).get('Code')
+            if code in ('NoSuchKey', '404', 'AccessDenied', '403'):
+                return None
+            raise
+        return response['Body'].read()
+
+class Archive(object):
+    """
+    Answers time-series queries from the daily exports written by
+    DatabaseHandler.write_to_s3. With columnar set (i.e. COLUMNAR_EXPORT is
+    on) the columnar export is tried first, falling back to the JSONL export
+    for days from before it was turned on; otherwise only the JSONL export is
+    looked for, saving a request per day.
+
+    Each day is fetched once, decompressed into a small indexed SQLite file in
+    cache_dir, and reused from there; once a query is done, the least recently
+    used days are removed if more than cache_days are cached. Days that turn
+    out to be missing are marked in cache_dir too, so the HTTP server's
+    prefetch, the database thread and any worker processes all see them.
+    """
+
+    # how long to wait before looking for a missing day again, in case a
+    # mirror sync or a late export has added it since
+    MISSING_TTL = 60 * 60
+
+    def __init__(self, source, cache_dir, s3_path, s3_interval = 24 * 60 * 60, cache_days = 366, max_days = 366, columnar = False):
+        self.source = source
+        self.cache_dir = cache_dir
+        self.s3_path = s3_path
+        self.s3_interval = s3_interval
+        self.cache_days = cache_days
+        self.max_days = max_days
+        self.columnar = columnar
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, period_start, extension='.json.gz'):
+        # must match the naming in DatabaseHandler.write_to_s3
+        date_string = datetime.fromtimestamp(period_start).isoformat()
+        return '{}sensor_logging_{}{}'.format(self.s3_path, date_string, extension)
+
+    def fetch(self, period_start):
+        # returns a list of (t, topic, value) rows for the day, or None
+        body = None
+        if self.columnar:
+            body = self.source.get(self.key(period_start, columnar.EXTENSION))
+        if body is not None:
+            rows = []
+            with columnar.ColumnarFile(io.BytesIO(body)) as f:
+                for (t, values) in f.rows_for(f.columns):
+                    rows.extend((t, topic, value) for (topic, value) in values.items())
+            return rows
+
+        body = self.source.get(self.key(period_start))
+        if body is not None:
+            # DirectorySource may hand back an uncompressed .json file
+            if body[:2] == GZIP_MAGIC:
+                body = gzip.decompress(body)
+            rows = []
+            for line in body.decode('utf-8').splitlines():
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                t = row.pop('t')
+                rows.extend((t, topic, value) for (topic, value) in row.items())
+            return rows
+
+        return None
+
+    def window(self, since, until, cutoff):
+        """
+        Returns the (since, until) part of a query that's older than cutoff
+        and no more than max_days before it, or None if there isn't any.
+        """
+        archive_since = max(since, cutoff - (self.max_days * self.s3_interval))
+        archive_until = min(until, cutoff) if until else cutoff
+        if archive_since >= archive_until:
+            return None
+        return (archive_since, archive_until)
+
+    def periods(self, since, until):
+        period_start = math.floor(since / self.s3_interval) * self.s3_interval
+        while period_start < until:
+            yield period_start
+            period_start += self.s3_interval
+
+    def prefetch(self, since, until):
+        # download and cache every day over (since, until) that isn't
+        # already, without querying any of them
+        for period_start in self.periods(since, until):
+            self.day(period_start)
+
+    def day(self, period_start):
+        # returns the path of the cached database for the day, or None
+        key = self.key(period_start)
+        path = os.path.join(self.cache_dir, os.path.basename(key)[:-len('.json.gz')] + '.db')
+
+        if os.path.exists(path):
+            # bump the mtime, which is what eviction goes by
+            os.utime(path)
+            return path
+
+        # the marker's mtime is when the day was last looked for
+        marker = path[:-len('.db')] + '.missing'
+        try:
+            if time.time() - os.path.getmtime(marker) < self.MISSING_TTL:
+                return None
+        except FileNotFoundError:
+            pass
+
+        rows = self.fetch(period_start)
+        if rows is None:
+            now = time.time()
+            with open(marker, 'w'):
+                pass
+            os.utime(marker, (now, now))
+            return None
+
+        logging.info('caching archived day {}'.format(key))
+        # requests prefetch on their own threads, so one may be fetching the same day
+        tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        conn = sqlite3.connect(tmp_path)
+        try:
+            # t is REAL rather than NUMERIC so whole-second times aren't stored
+            # as integers, which would make round(t / chunk) integer division
+            conn.execute('CREATE TABLE data (t REAL, topic TEXT, value NUMERIC)')
+            conn.executemany('INSERT INTO data (t, topic, value) VALUES (?, ?, ?)', rows)
+            conn.execute('CREATE INDEX data_topic_t ON data (topic, t)')
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, path)
+        try:
+            os.remove(marker)
+        except FileNotFoundError:
+            pass
+        return path
+
+    def evict(self):
+        # expired missing-day markers would only be rewritten, so drop them
+        for f in os.listdir(self.cache_dir):
+            marker = os.path.join(self.cache_dir, f)
+            try:
+                if f.endswith('.missing') and time.time() - os.path.getmtime(marker) >= self.MISSING_TTL:
+                    os.remove(marker)
+            except FileNotFoundError:
+                pass
+
+        cached = [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir) if f.endswith('.db')]
+        if len(cached) <= self.cache_days:
+            return
+
+        cached.sort(key=lambda f: os.path.getmtime(f))
+        for path in cached[:len(cached) - self.cache_days]:
+            logging.info('evicting archived day {}'.format(path))
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def buckets(self, topics, chunk, since, until):
+        """
+        Returns {topic: {bucket: [sum, count]}} for topics over (since, until),
+        using the same bucketing as DatabaseHandler.handle_time_series so the
+        results can be merged with the in-memory database's.
+
+        Each day is visited once for all topics, and nothing is evicted until
+        the whole query is done, so a query spanning more than cache_days
+        doesn't evict days it's about to read.
+        """
+        out = {topic: {} for topic in topics}
+        for period_start in self.periods(since, until):
+            path = self.day(period_start)
+            if path is not None:
+                conn = sqlite3.connect('file:{}?mode=ro'.format(path), uri=True)
+                try:
+                    sql = """
+                        SELECT topic, (round(t / ?) * ?), SUM(value), COUNT(value) FROM data
+                        WHERE topic IN ({}) AND t > ? AND t < ?
+                        GROUP BY topic, round(t / ?)""".format(', '.join('?' * len(topics)))
+                    params = [chunk, chunk] + list(topics) + [since, until, chunk]
+                    for (topic, bucket, total, count) in conn.execute(sql, params):
+                        add_bucket(out[topic], bucket, total, count)
+                finally:
+                    conn.close()
+
+        self.evict()
+        return out
@@ -0,0 +1,108 @@
+"""
+Packed columnar format for the daily exports.
+
+A file is the magic bytes, a little-endian uint32 header length, a JSON
+header, and then one zlib-compressed block of little-endian float64 values
+per column. Missing readings are NaN. The header records every column's
+offset, size, min, max and non-NaN count, so readers can decide whether a
+file (or a column in it) is worth reading from the header alone and then
+seek straight to the columns they need.
+"""
+import os
+import sys
+import json
+import math
+import zlib
+import struct
+from array import array
+
+MAGIC = b'SLCOL1\n'
+EXTENSION = '.cols'
+
+def _pack(values):
+    column = array('d', values)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return zlib.compress(column.tobytes())
+
+def _unpack(block):
+    column = array('d')
+    column.frombytes(zlib.decompress(block))
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+def dumps(t, columns):
+    """
+    Encodes a time index t and a dict of {name: values} (each the same length
+    as t, with None for missing values) as a columnar file.
+    """
+    blocks = []
+    header = {'rows': len(t), 'columns': []}
+    offset = 0
+    for (name, values) in [('t', t)] + sorted(columns.items()):
+        values = [math.nan if v is None else float(v) for v in values]
+        present = [v for v in values if not math.isnan(v)]
+        block = _pack(values)
+        header['columns'].append({
+            'name': name,
+            'offset': offset,
+            'length': len(block),
+            'count': len(present),
+            'min': min(present) if present else None,
+            'max': max(present) if present else None
+        })
+        blocks.append(block)
+        offset += len(block)
+
+    header = json.dumps(header).encode('utf-8')
+    return MAGIC + struct.pack('<I', len(header)) + header + b''.join(blocks)
+
+class ColumnarFile(object):
+    """
+    Reads a columnar file from a path or an open binary file object. Only the
+    header is read up front; columns are read and decompressed on request.
+    """
+
+    def __init__(self, f):
+        if isinstance(f, (str, os.PathLike)):
+            f = open(f, 'rb')
+        self.f = f
+
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('not a sensor_logging columnar file')
+        (header_length,) = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(header_length).decode('utf-8'))
+
+        self.rows = header['rows']
+        self.stats = {c['name']: c for c in header['columns']}
+        self.data_offset = len(MAGIC) + 4 + header_length
+
+    @property
+    def columns(self):
+        return [name for name in self.stats if name != 't']
+
+    def overlaps(self, since, until):
+        # whether any row falls within [since, until), judging by the header
+        t = self.stats['t']
+        return t['count'] > 0 and t['max'] >= since and t['min'] < until
+
+    def read(self, name):
+        stats = self.stats[name]
+        self.f.seek(self.data_offset + stats['offset'])
+        return _unpack(self.f.read(stats['length']))
+
+    def rows_for(self, names):
+        # yields (t, {name: value}) for each row, skipping missing values
+        columns = {name: self.read(name) for name in names if name in self.stats}
+        for (i, t) in enumerate(self.read('t')):
+            yield (t, {name: c[i] for (name, c) in columns.items() if not math.isnan(c[i])})
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,29 +1,141 @@
-import csv, json, sys, datetime
-import pytz
-
-EST = pytz.timezone('US/Eastern')
-
-keys = {}
-with open(sys.argv[1]) as f:
-    for line in f.readlines():
-        j = json.loads(line)
-        for k in j:
-            if k == 't':
-                continue
-            keys[k] = True
-
-fields = list(keys.keys())
-fields.sort()
-fields = ['t'] + fields
-writer = csv.writer(sys.stdout)
-writer.writerow(fields)
-
-with open(sys.argv[1]) as f:
-    for line in f.readlines():
-        row = []
-        j = json.loads(line)
-        for f in fields:
-            row.append(j.get(f, ''))
-        row[0] = datetime.datetime.fromtimestamp(row[0]).astimezone(EST).isoformat()
-        writer.writerow(row)
+"""
+Converts daily exports (.json, .json.gz or .cols) into a single CSV.
 
+    python3 csvify.py sensor_logging_2021-12-*.json.gz > xmas.csv
+    python3 csvify.py --columns 'xmas/*' --tz UTC exports/ > xmas.csv
+
+Inputs may be files, directories or globs. Files are parsed (and their
+times converted) in parallel into sorted temporary files, which are then
+streamed through a merge in time order under one header covering every
+column seen (or just the ones selected with --columns), so memory use
+doesn't grow with the number of files.
+"""
+import os
+import csv
+import sys
+import glob
+import gzip
+import json
+import heapq
+import fnmatch
+import argparse
+import datetime
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+EXTENSIONS = ('.json', '.json.gz', '.cols')
+
+def expand(inputs):
+    paths = []
+    for i in inputs:
+        if os.path.isdir(i):
+            candidates = [os.path.join(i, f) for f in os.listdir(i)]
+        else:
+            candidates = glob.glob(i) or [i]
+        paths.extend(c for c in candidates if c.endswith(EXTENSIONS))
+    return sorted(set(paths))
+
+def read_file(path):
+    """Returns (columns, rows) for one export, with rows as time-sorted (t, dict) tuples."""
+    columns = set()
+    rows = []
+
+    if path.endswith('.cols'):
+        # imported here so the script still runs standalone for JSON input
+        from sensor_logging import columnar
+        with columnar.ColumnarFile(path) as f:
+            columns.update(f.columns)
+            rows = list(f.rows_for(f.columns))
+    else:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                t = row.pop('t')
+                columns.update(row)
+                rows.append((t, row))
+
+    rows.sort(key=lambda r: r[0])
+    return (columns, rows)
+
+def convert_file(path, tz_name, epoch, tempdir):
+    """
+    Parses one export and writes its rows, time-sorted and with their output
+    timestamps, to a temporary file in tempdir as [t, timestamp, row] JSON
+    lines. Returns (columns, temporary file path).
+    """
+    (columns, rows) = read_file(path)
+
+    # converting times here spreads the work across the worker processes
+    # instead of leaving it all to the merge
+    if epoch:
+        timestamps = [t for (t, row) in rows]
+    else:
+        tz = ZoneInfo(tz_name)
+        timestamps = [datetime.datetime.fromtimestamp(t, tz).isoformat() for (t, row) in rows]
+
+    (fd, out_path) = tempfile.mkstemp(suffix='.jsonl', dir=tempdir)
+    with os.fdopen(fd, 'w') as f:
+        for ((t, row), timestamp) in zip(rows, timestamps):
+            f.write(json.dumps([t, timestamp, row]) + '\n')
+    return (columns, out_path)
+
+def read_converted(path):
+    with open(path) as f:
+        for line in f:
+            yield json.loads(line)
+
+def select_columns(columns, patterns):
+    if not patterns:
+        return sorted(columns)
+    return sorted(c for c in columns if any(fnmatch.fnmatchcase(c, p) for p in patterns))
+
+def main(argv=None, stdout=None):
+    parser = argparse.ArgumentParser(description='Merge sensor_logging daily exports into one time-sorted CSV')
+    parser.add_argument('inputs', nargs='+', help='export files, directories or globs')
+    parser.add_argument('-o', '--output', help='write to this file instead of stdout')
+    parser.add_argument('-c', '--columns', help='comma-separated column names or glob patterns to include')
+    parser.add_argument('--tz', default='US/Eastern', help='timezone for the t column (default: US/Eastern)')
+    parser.add_argument('--epoch', action='store_true', help='leave t as a unix timestamp')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='parallel parser processes')
+    args = parser.parse_args(argv)
+
+    paths = expand(args.inputs)
+    if not paths:
+        parser.error('no export files found')
+
+    # fail on a bad timezone before starting any workers
+    try:
+        ZoneInfo(args.tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        parser.error('unknown timezone: {}'.format(args.tz))
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        jobs = [(path, args.tz, args.epoch, tempdir) for path in paths]
+        if len(paths) > 1 and args.jobs > 1:
+            with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+                results = list(pool.map(convert_file, *zip(*jobs)))
+        else:
+            results = [convert_file(*job) for job in jobs]
+
+        columns = set()
+        for (file_columns, converted) in results:
+            columns.update(file_columns)
+        fields = select_columns(columns, args.columns.split(',') if args.columns else None)
+
+        out = open(args.output, 'w', newline='') if args.output else (stdout or sys.stdout)
+        try:
+            writer = csv.writer(out)
+            writer.writerow(['t'] + fields)
+            streams = [read_converted(converted) for (file_columns, converted) in results]
+            for (t, timestamp, row) in heapq.merge(*streams, key=lambda r: r[0]):
+                writer.writerow([timestamp] + [row.get(f, '') for f in fields])
+        finally:
+            if args.output:
+                out.close()
+
+if __name__ == '__main__':
+    main()
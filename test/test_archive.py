@@ -0,0 +1,75 @@
+import unittest
+import io
+import os
+import gzip
+import json
+import tempfile
+from unittest.mock import MagicMock
+from sensor_logging.archive import Archive, S3Source
+
+try:
+    from botocore.exceptions import ClientError
+except ImportError:
+    # the same shape as botocore's, which is all S3Source looks at
+    class ClientError(Exception):
+        def __init__(self, error_response, operation_name):
+            super().__init__(error_response['Error']['Code'])
+            self.response = error_response
+
+def client_error(code):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, 'GetObject')
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.s3_client = MagicMock()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_001_s3_missing_keys(self):
+        source = S3Source(self.s3_client, 'test-bucket')
+
+        # without s3:ListBucket, a missing key is a 403 rather than a 404
+        for code in ('NoSuchKey', '404', 'AccessDenied', '403'):
+            self.s3_client.get_object.side_effect = client_error(code)
+            self.assertIsNone(source.get('test-path/missing.json.gz'))
+
+        self.s3_client.get_object.side_effect = client_error('SlowDown')
+        with self.assertRaises(ClientError):
+            source.get('test-path/missing.json.gz')
+
+    def test_002_s3_archive(self):
+        body = gzip.compress('\n'.join(json.dumps(row) for row in [
+            {'t': 1620000000.0, 'topic1': 1.0},
+            {'t': 1620000300.0, 'topic1': 3.0}
+        ]).encode('utf-8'))
+
+        archive = Archive(S3Source(self.s3_client, 'test-bucket'), self.tempdir.name, 'test-path/')
+
+        # only one day was exported; the others are denied, as S3 does
+        # for missing keys without s3:ListBucket
+        def get_object(Bucket, Key):
+            if Key == archive.key(1620000000):
+                return {'Body': io.BytesIO(body)}
+            raise client_error('AccessDenied')
+        self.s3_client.get_object.side_effect = get_object
+
+        buckets = archive.buckets(['topic1'], 3600, 1620000000 - (2 * 24 * 60 * 60), 1620000000 + (24 * 60 * 60))
+        self.assertEqual(buckets, {'topic1': {1620000000: [4.0, 2]}})
+
+        # without COLUMNAR_EXPORT, there's no .cols to look for
+        keys = [call[1]['Key'] for call in self.s3_client.get_object.call_args_list]
+        self.assertEqual(len(keys), 3)
+        self.assertTrue(all(key.endswith('.json.gz') for key in keys))
+
+        # with it, days from before it was turned on fall back to .json.gz
+        self.s3_client.get_object.reset_mock()
+        archive = Archive(S3Source(self.s3_client, 'test-bucket'), os.path.join(self.tempdir.name, 'columnar'), 'test-path/', columnar=True)
+        buckets = archive.buckets(['topic1'], 3600, 1620000000 - 1, 1620000000 + (24 * 60 * 60))
+        self.assertEqual(buckets, {'topic1': {1620000000: [4.0, 2]}})
+        keys = [call[1]['Key'] for call in self.s3_client.get_object.call_args_list]
+        self.assertEqual(keys[-2:], [archive.key(1620000000, '.cols'), archive.key(1620000000)])
+
+if __name__ == '__main__':
+    unittest.main()
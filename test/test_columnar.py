@@ -0,0 +1,50 @@
+import unittest
+import io
+import os
+import math
+import tempfile
+from sensor_logging import columnar
+
+class TestColumnar(unittest.TestCase):
+    def setUp(self):
+        self.t = [1620000000.0 + (i * 300) for i in range(4)]
+        self.columns = {
+            'topic1': [1.0, None, 3.0, 4.5],
+            'topic2': [None, None, None, None]
+        }
+        self.body = columnar.dumps(self.t, self.columns)
+
+    def test_001_round_trip(self):
+        with columnar.ColumnarFile(io.BytesIO(self.body)) as f:
+            self.assertEqual(f.rows, 4)
+            self.assertEqual(f.columns, ['topic1', 'topic2'])
+            self.assertEqual(list(f.read('t')), self.t)
+
+            topic1 = f.read('topic1')
+            self.assertEqual([topic1[0], topic1[2], topic1[3]], [1.0, 3.0, 4.5])
+            self.assertTrue(math.isnan(topic1[1]))
+
+            rows = list(f.rows_for(['topic1', 'missing']))
+            self.assertEqual(rows[0], (self.t[0], {'topic1': 1.0}))
+            self.assertEqual(rows[1], (self.t[1], {}))
+
+    def test_002_header_stats(self):
+        tempdir = tempfile.TemporaryDirectory()
+        path = os.path.join(tempdir.name, 'day.cols')
+        with open(path, 'wb') as f:
+            f.write(self.body)
+
+        with columnar.ColumnarFile(path) as f:
+            self.assertEqual((f.stats['topic1']['min'], f.stats['topic1']['max'], f.stats['topic1']['count']), (1.0, 4.5, 3))
+            self.assertEqual((f.stats['topic2']['min'], f.stats['topic2']['count']), (None, 0))
+            self.assertTrue(f.overlaps(self.t[-1], self.t[-1] + 1))
+            self.assertFalse(f.overlaps(self.t[-1] + 1, self.t[-1] + 100))
+
+        tempdir.cleanup()
+
+    def test_003_rejects_other_files(self):
+        with self.assertRaises(ValueError):
+            columnar.ColumnarFile(io.BytesIO(b'not columnar'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+import io
+import os
+import csv
+import gzip
+import json
+import tempfile
+from contextlib import redirect_stderr
+from sensor_logging import csvify, columnar
+
+class TestCsvify(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+
+        # two days, written out of order and in different formats
+        with gzip.open(os.path.join(self.tempdir.name, 'sensor_logging_2021-05-04T00:00:00.json.gz'), 'wt') as f:
+            f.write(json.dumps({'t': 1620086400, 'xmas/level': 3.0, 'co2/ppm': 400.0}) + '\n')
+            f.write(json.dumps({'t': 1620086700, 'xmas/level': 4.0}) + '\n')
+        with open(os.path.join(self.tempdir.name, 'sensor_logging_2021-05-03T00:00:00.json'), 'w') as f:
+            f.write(json.dumps({'t': 1620000000, 'xmas/level': 1.0}) + '\n')
+        with open(os.path.join(self.tempdir.name, 'sensor_logging_2021-05-02T00:00:00.cols'), 'wb') as f:
+            f.write(columnar.dumps([1619913600.0], {'xmas/level': [0.5], 'aq/pm25': [None]}))
+
+        # not an export
+        with open(os.path.join(self.tempdir.name, 'notes.txt'), 'w') as f:
+            f.write('ignore me')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def run_csvify(self, *args):
+        out = io.StringIO()
+        csvify.main(list(args), stdout=out)
+        return list(csv.reader(io.StringIO(out.getvalue())))
+
+    def test_001_merge_directory(self):
+        rows = self.run_csvify('--tz', 'UTC', '--jobs', '2', self.tempdir.name)
+        self.assertEqual(rows[0], ['t', 'aq/pm25', 'co2/ppm', 'xmas/level'])
+        self.assertEqual([r[0] for r in rows[1:]], [
+            '2021-05-02T00:00:00+00:00',
+            '2021-05-03T00:00:00+00:00',
+            '2021-05-04T00:00:00+00:00',
+            '2021-05-04T00:05:00+00:00'
+        ])
+        self.assertEqual(rows[3][1:], ['', '400.0', '3.0'])
+
+    def test_002_select_columns(self):
+        rows = self.run_csvify('--epoch', '--columns', 'xmas/*', os.path.join(self.tempdir.name, '*.json*'))
+        self.assertEqual(rows, [
+            ['t', 'xmas/level'],
+            ['1620000000', '1.0'],
+            ['1620086400', '3.0'],
+            ['1620086700', '4.0']
+        ])
+
+    def test_003_timezone(self):
+        rows = self.run_csvify('--jobs', '1', os.path.join(self.tempdir.name, 'sensor_logging_2021-05-03T00:00:00.json'))
+        self.assertEqual(rows[1][0], '2021-05-02T20:00:00-04:00')
+
+    def test_004_unknown_timezone(self):
+        with self.assertRaises(SystemExit) as cm:
+            with redirect_stderr(io.StringIO()) as err:
+                self.run_csvify('--tz', 'Nowhere/Special', self.tempdir.name)
+        self.assertEqual(cm.exception.code, 2)
+        self.assertIn('unknown timezone: Nowhere/Special', err.getvalue())
+
+    def test_005_convert_file(self):
+        path = os.path.join(self.tempdir.name, 'sensor_logging_2021-05-04T00:00:00.json.gz')
+        (columns, converted) = csvify.convert_file(path, 'UTC', False, self.tempdir.name)
+        self.assertEqual(columns, {'xmas/level', 'co2/ppm'})
+        self.assertEqual(list(csvify.read_converted(converted)), [
+            [1620086400, '2021-05-04T00:00:00+00:00', {'xmas/level': 3.0, 'co2/ppm': 400.0}],
+            [1620086700, '2021-05-04T00:05:00+00:00', {'xmas/level': 4.0}]
+        ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,11 @@
 import unittest
 from unittest.mock import patch, MagicMock
-import time, math, gzip, os, json, tempfile, filecmp
+import time, math, gzip, os, io, json, tempfile, filecmp, shutil
 import queue
 import logging
 import uuid
 import threading
-from sensor_logging import DatabaseHandler
+from sensor_logging import DatabaseHandler, HttpServer, QueryWorker, TaskError, columnar
 from test import Accumulator, enable_fixtures
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
@@ -40,6 +40,8 @@ class TestDatabaseHandler(unittest.TestCase):
     def reset_database_contents(self):
         cursor = self.db_handler.conn.cursor()
         cursor.execute('DELETE FROM data')
+        if self.db_handler.has_aggregates:
+            cursor.execute('DELETE FROM aggregates')
         self.db_handler.conn.commit()
         self.assertEqual(self.count_entries(), 0)
 
@@ -230,5 +232,468 @@ class TestDatabaseHandler(unittest.TestCase):
         self.db_handler.flush_to_disk()
         self.compare_to_fixture(self.flush_filename, 'fixtures/db_handler_flush.db', obj_is_file_path=True)
 
+    def test_007_slow_query_log(self):
+
+        logging.info('test_007_slow_query_log')
+
+        self.reset_database_contents()
+        self.db_handler.insert('topic1', 1)
+
+        qsparams = {'topic': ['topic1'], 'chunk': [60]}
+
+        self.db_handler.SLOW_QUERY_THRESHOLD = 60
+        self.db_handler.handle_time_series(qsparams)
+        self.assertEqual(len(self.db_handler.slow_queries), 0)
+
+        self.db_handler.SLOW_QUERY_THRESHOLD = 0
+        self.assertEqual(self.db_handler.handle_time_series(qsparams), self.db_handler.query_time_series(qsparams))
+        self.assertEqual(len(self.db_handler.slow_queries), 1)
+        self.assertEqual(self.db_handler.slow_queries[0]['params'], qsparams)
+
+    @patch('time.time')
+    def test_008_profile(self, mock_time):
+
+        logging.info('test_008_profile')
+
+        mock_time.return_value = 1620000000
+        self.reset_database_contents()
+
+        db_thread = threading.Thread(target=self.db_handler.loop, kwargs={'until': 1620000000 + 100}, daemon=True)
+        db_thread.start()
+
+        self.task_queue.put(((1, 'profile'), {'seconds': 10, 'sort': 'cumulative', 'limit': 10}))
+        self.task_queue.put(((2, 'ping'), {}))
+        self.task_queue.join()
+        self.assertEqual(self.response_queue.get(timeout=5), (2, 'pong'))
+
+        # the report only arrives once the profile's time is up
+        self.assertTrue(self.response_queue.empty())
+        mock_time.return_value += 11
+
+        (task_id, report) = self.response_queue.get(timeout=5)
+        self.assertEqual(task_id, 1)
+        self.assertIn('function calls', report)
+
+        mock_time.return_value = 1620000000 + 101
+        db_thread.join()
+
+    @patch('time.time')
+    def test_009_fast_start_restore(self, mock_time):
+
+        logging.info('test_009_fast_start_restore')
+
+        start_time = 1620000000
+        duration = 24 * 60 * 60
+
+        mock_time.return_value = start_time
+        self.reset_database_contents()
+
+        acc = Accumulator()
+        while mock_time() < (start_time + duration):
+            self.db_handler.insert('topic1', acc.get())
+            mock_time.return_value += 900
+
+        self.db_handler.flush_to_disk()
+        self.reset_database_contents()
+
+        config = dict(self.config, FAST_START=True, RESTORE_CHUNK=24)
+        db_handler = DatabaseHandler(self.task_queue, self.response_queue, self.mock_s3_client, config, self.flush_filename)
+
+        # nothing is restored up front; live inserts can go straight in
+        self.assertEqual(self.count_entries(), 0)
+        self.assertEqual(len(db_handler.restore_partitions), 4)
+        db_handler.insert('topic2', 1, start_time + duration)
+
+        # the newest chunk comes back first
+        db_handler.restore_step()
+        cursor = self.db_handler.conn.cursor()
+        self.assertEqual(cursor.execute("SELECT MIN(t) FROM data WHERE topic = 'topic1'").fetchone()[0], start_time + (18 * 60 * 60))
+
+        # flushing must not overwrite the file with a partial database
+        db_handler.flush_to_disk()
+        self.assertEqual(db_handler.restore_partitions, [])
+        self.assertEqual(self.count_entries(), 97)
+
+    @patch('time.time')
+    def test_010_query_worker(self, mock_time):
+
+        logging.info('test_010_query_worker')
+
+        start_time = 1620000000
+        duration = 24 * 60 * 60
+
+        mock_time.return_value = start_time
+        self.reset_database_contents()
+
+        acc = Accumulator()
+        while mock_time() < (start_time + duration):
+            self.db_handler.insert('topic1', acc.get())
+            self.db_handler.insert('topic2', acc.get())
+            self.db_handler.insert('topic3', acc.get())
+            mock_time.return_value += 900
+
+        config = dict(self.config, SNAPSHOT_PATH=os.path.join(self.tempdir.name, 'snapshot.db'))
+        self.db_handler.SNAPSHOT_PATH = config['SNAPSHOT_PATH']
+        self.db_handler.snapshot()
+        self.assertFalse(self.db_handler.dirty)
+
+        worker_rx = queue.Queue()
+        worker_tx = queue.Queue()
+        worker_s3_client = MagicMock()
+        worker = QueryWorker(worker_rx, worker_tx, worker_s3_client, config)
+        worker_thread = threading.Thread(target=worker.loop, daemon=True)
+        worker_thread.start()
+
+        qsparams = {'chunk': [60 * 15], 'topic': ['topic1', 'topic2', 'topic3'], 'since': [start_time]}
+        worker_rx.put(((1, 'query'), qsparams))
+        (task_id, result) = worker_tx.get(timeout=5)
+        self.assertEqual(task_id, 1)
+        self.assertEqual(json.loads(result), json.loads(json.dumps(self.db_handler.handle_time_series(qsparams))))
+
+        # conditional queries are versioned by the snapshot; since lands on a
+        # bucket edge so it isn't snapped
+        cached_qsparams = dict(qsparams, since=[start_time - 450])
+        worker_rx.put(((5, 'time_series'), (cached_qsparams, None)))
+        (etag, last_modified, result) = worker_tx.get(timeout=5)[1]
+        self.assertEqual(json.loads(result), json.loads(json.dumps(self.db_handler.handle_time_series(cached_qsparams))))
+        worker_rx.put(((6, 'time_series'), (cached_qsparams, etag)))
+        self.assertEqual(worker_tx.get(timeout=5), (6, (etag, last_modified, None)))
+
+        # the worker picks up a replaced snapshot on its next task
+        self.db_handler.insert('topic4', 1)
+        self.db_handler.snapshot()
+        worker_rx.put(((2, 'query'), {'topic': ['topic4'], 'since': [start_time]}))
+        self.assertEqual(len(json.loads(worker_tx.get(timeout=5)[1])['topic4']), 1)
+        worker_rx.put(((7, 'time_series'), (cached_qsparams, etag)))
+        self.assertNotEqual(worker_tx.get(timeout=5)[1][0], etag)
+
+        # exports produce the same artifacts as the writer would
+        worker_rx.put(((3, 'export'), math.floor(mock_time() / self.config['S3_INTERVAL'])))
+        worker_rx.put(((4, 'ping'), {}))
+        self.assertEqual(worker_tx.get(timeout=5), (4, 'pong'))
+        self.db_handler.write_to_s3()
+        self.assertEqual(worker_s3_client.put_object.call_args_list, self.mock_s3_client.put_object.call_args_list)
+
+        worker_rx.put(None)
+        worker_thread.join()
+
+    @patch('time.time')
+    def test_011_archive_federation(self, mock_time):
+
+        logging.info('test_011_archive_federation')
+
+        start_time = 1620000000
+        duration = 2 * 24 * 60 * 60
+
+        mock_time.return_value = start_time
+        self.reset_database_contents()
+
+        acc = Accumulator()
+        while mock_time() < (start_time + duration):
+            self.db_handler.insert('topic1', acc.get())
+            mock_time.return_value += 900
+
+        # export both days into a local stand-in for the bucket
+        mirror = os.path.join(self.tempdir.name, 'mirror')
+        os.mkdir(mirror)
+        for day in (1, 2):
+            self.db_handler.write_to_s3(math.floor(start_time / self.config['S3_INTERVAL']) + day)
+        expected = {}
+        for call in self.mock_s3_client.put_object.call_args_list:
+            if call[1]['Key'].endswith('.json.gz'):
+                with open(os.path.join(mirror, os.path.basename(call[1]['Key'])), 'wb') as f:
+                    f.write(call[1]['Body'])
+                for line in gzip.decompress(call[1]['Body']).decode('utf-8').splitlines():
+                    row = json.loads(line)
+                    expected.setdefault(math.floor((row['t'] / 3600) + 0.5) * 3600, []).append(row['topic1'])
+
+        # age everything out of memory, leaving one fresh reading
+        mock_time.return_value = start_time + duration + self.config['RETENTION_PERIOD']
+        self.db_handler.trim_database()
+        self.db_handler.insert('topic1', 50)
+
+        qsparams = {'topic': ['topic1'], 'chunk': [3600], 'since': [start_time - 1]}
+        self.assertEqual(len(self.db_handler.handle_time_series(qsparams)['topic1']), 1)
+
+        config = dict(self.config, ARCHIVE_DIR=mirror, ARCHIVE_CACHE_DIR=os.path.join(self.tempdir.name, 'cache'), ARCHIVE_CACHE_DAYS=1)
+        db_handler = DatabaseHandler(self.task_queue, self.response_queue, self.mock_s3_client, config, False)
+
+        result = db_handler.handle_time_series(qsparams)['topic1']
+        self.assertEqual(len(result), len(expected) + 1)
+        for ((bucket, value), (expected_bucket, values)) in zip(result, sorted(expected.items())):
+            self.assertEqual(bucket, expected_bucket)
+            self.assertAlmostEqual(value, sum(values) / len(values))
+        self.assertEqual(result[-1][1], 50)
+
+        # only the most recently used day stays cached, and cached days
+        # don't need the source any more
+        self.assertEqual(len([f for f in os.listdir(config['ARCHIVE_CACHE_DIR']) if f.endswith('.db')]), 1)
+        qsparams['until'] = [start_time + duration]
+        last_day = db_handler.handle_time_series(qsparams)['topic1'][-1]
+        shutil.rmtree(mirror)
+        self.assertEqual(db_handler.handle_time_series(qsparams)['topic1'][-1], last_day)
+
+    @patch('time.time')
+    def test_012_columnar_export(self, mock_time):
+
+        logging.info('test_012_columnar_export')
+
+        start_time = 1620000000
+        duration = 24 * 60 * 60
+
+        mock_time.return_value = start_time
+        self.reset_database_contents()
+
+        acc = Accumulator()
+        while mock_time() < (start_time + duration):
+            self.db_handler.insert('topic1', acc.get())
+            self.db_handler.insert('topic2', acc.get())
+            mock_time.return_value += 900
+
+        self.db_handler.COLUMNAR_EXPORT = True
+        self.db_handler.write_to_s3()
+
+        calls = self.mock_s3_client.put_object.call_args_list
+        self.assertEqual(len(calls), 3)
+        json_body = [call[1]['Body'] for call in calls if call[1]['Key'].endswith('.json.gz')][0]
+        columnar_body = [call[1]['Body'] for call in calls if call[1]['Key'].endswith(columnar.EXTENSION)][0]
+
+        # the columnar export holds the same medians as the JSONL export
+        json_rows = [json.loads(line) for line in gzip.decompress(json_body).decode('utf-8').splitlines()]
+        with columnar.ColumnarFile(io.BytesIO(columnar_body)) as f:
+            self.assertEqual(f.columns, ['topic1', 'topic2'])
+            for ((t, values), json_row) in zip(f.rows_for(f.columns), json_rows):
+                self.assertEqual(dict(values, t=t), json_row)
+
+    @patch('time.time')
+    def test_013_cached_time_series(self, mock_time):
+
+        logging.info('test_013_cached_time_series')
+
+        start_time = 1620000000
+        mock_time.return_value = start_time
+        self.reset_database_contents()
+
+        acc = Accumulator()
+        for i in range(10):
+            self.db_handler.insert('topic1', acc.get())
+            self.db_handler.insert('topic2', acc.get())
+            mock_time.return_value += 60
+
+        qsparams = {'topic': ['topic1'], 'chunk': [120], 'since': [start_time - 60]}
+        (etag, last_modified, data) = self.db_handler.handle_cached_time_series(qsparams)
+        self.assertEqual(last_modified, start_time + 540)
+        self.assertEqual(data, self.db_handler.handle_time_series(qsparams))
+
+        # a sliding since within the same bucket gets the same result
+        sliding = dict(qsparams, since=[start_time - 10])
+        self.assertEqual(self.db_handler.handle_cached_time_series(sliding)[0], etag)
+
+        # unchanged data isn't queried again
+        self.assertEqual(self.db_handler.handle_cached_time_series(qsparams, etag), (etag, last_modified, None))
+        self.assertIsNotNone(self.db_handler.handle_cached_time_series(qsparams, '"stale"')[2])
+
+        # writes to other topics don't invalidate, writes to this one do
+        self.db_handler.insert('topic2', acc.get())
+        self.assertEqual(self.db_handler.handle_cached_time_series(qsparams)[0], etag)
+        self.db_handler.insert('topic1', acc.get())
+        (new_etag, new_last_modified, data) = self.db_handler.handle_cached_time_series(qsparams, etag)
+        self.assertNotEqual(new_etag, etag)
+        self.assertEqual(new_last_modified, start_time + 600)
+        self.assertIsNotNone(data)
+
+        # since_bucket returns only that bucket and newer
+        last_bucket = data['topic1'][-1][0]
+        delta = self.db_handler.handle_cached_time_series(dict(qsparams, since_bucket=[last_bucket]))[2]
+        self.assertEqual(delta, {'topic1': [data['topic1'][-1]]})
+
+        # trimming invalidates everything
+        self.db_handler.trim_database(since=start_time + 300)
+        self.assertNotEqual(self.db_handler.handle_cached_time_series(qsparams)[0], new_etag)
+
+    @patch('time.time')
+    def test_014_memory_limit(self, mock_time):
+
+        logging.info('test_014_memory_limit')
+
+        start_time = 1620000000
+        duration = 3 * 24 * 60 * 60
+
+        # fractional times, like real readings; whole-second ones would be
+        # stored as integers and bucketed by integer division
+        mock_time.return_value = start_time + 0.25
+        self.reset_database_contents()
+
+        acc = Accumulator()
+        while mock_time() < (start_time + duration):
+            self.db_handler.insert('topic1', acc.get())
+            self.db_handler.insert('topic2', acc.get())
+            mock_time.return_value += 30
+
+        keep_raw_since = mock_time() - (24 * 60 * 60)
+        raw_recent = self.db_handler.conn.execute('SELECT COUNT(*) FROM data WHERE t >= ?', (keep_raw_since,)).fetchone()[0]
+
+        # bucket sizes that are multiples of AGGREGATION_INTERVAL
+        interval = self.config['AGGREGATION_INTERVAL']
+        chunks = (interval, 2 * interval, 3 * interval, 24 * 60 * 60)
+        def query_all():
+            return {chunk: self.db_handler.handle_time_series({'topic': ['topic1'], 'chunk': [chunk], 'since': [start_time - 1]})['topic1'] for chunk in chunks}
+        before = query_all()
+
+        # comfortably under the limit: nothing happens
+        used = self.db_handler.memory_usage()['used_bytes']
+        self.db_handler.MEMORY_LIMIT = used * 2
+        self.db_handler.MEMORY_KEEP_RAW = 24 * 60 * 60
+        self.db_handler.enforce_memory_limit()
+        self.assertEqual(query_all(), before)
+
+        # near it, old data is downsampled into (sum, count) rows per half
+        # bucket and recent data is left alone
+        self.db_handler.MEMORY_LIMIT = math.ceil(used / 0.95)
+        generation = self.db_handler.generation
+        self.db_handler.enforce_memory_limit()
+        self.assertLess(self.db_handler.memory_usage()['used_bytes'], self.db_handler.MEMORY_LIMIT * self.db_handler.MEMORY_LOW_WATER)
+        self.assertGreater(self.db_handler.generation, generation)
+        self.assertEqual(self.db_handler.conn.execute('SELECT COUNT(*) FROM data WHERE t >= ?', (keep_raw_since,)).fetchone()[0], raw_recent)
+        self.assertEqual(self.db_handler.conn.execute('SELECT COUNT(*) FROM data WHERE t < ?', (start_time + interval,)).fetchone()[0], 0)
+        self.assertEqual(self.db_handler.conn.execute('SELECT COUNT(*) FROM aggregates WHERE t < ?', (start_time + interval,)).fetchone()[0], 2 * 2)
+        self.assertEqual(self.db_handler.conn.execute("SELECT COUNT(*) FROM aggregates WHERE typeof(t) != 'real'").fetchone()[0], 0)
+
+        # bucket averages survive downsampling at every chunk size
+        after = query_all()
+        for chunk in chunks:
+            self.assertEqual([bucket for (bucket, value) in after[chunk]], [bucket for (bucket, value) in before[chunk]])
+            for ((bucket, value), (expected_bucket, expected)) in zip(after[chunk], before[chunk]):
+                self.assertAlmostEqual(value, expected)
+
+        # once there's nothing left to downsample, the oldest data is trimmed,
+        # but never the last MEMORY_KEEP_RAW seconds
+        while self.db_handler.downsample_step(keep_raw_since):
+            pass
+        self.db_handler.MEMORY_LIMIT = math.ceil(self.db_handler.memory_usage()['used_bytes'] / 0.95)
+        with self.assertLogs(level='WARNING') as logs:
+            self.db_handler.enforce_memory_limit()
+        self.assertIn('trimmed data older than', logs.output[0])
+        self.assertIn('raise MEMORY_LIMIT', logs.output[1])
+        self.assertEqual(self.db_handler.conn.execute('SELECT COUNT(*) FROM aggregates WHERE t < ?', (keep_raw_since,)).fetchone()[0], 0)
+        self.assertEqual(self.db_handler.conn.execute('SELECT COUNT(*) FROM data').fetchone()[0], raw_recent)
+
+    def test_015_query_worker_errors(self):
+
+        logging.info('test_015_query_worker_errors')
+
+        self.reset_database_contents()
+        self.db_handler.insert('topic1', 1)
+
+        config = dict(self.config, SNAPSHOT_PATH=os.path.join(self.tempdir.name, 'snapshot.db'), SLOW_QUERY_THRESHOLD=0)
+        worker_rx = queue.Queue()
+        worker_tx = queue.Queue()
+        worker = QueryWorker(worker_rx, worker_tx, MagicMock(), config)
+        worker_thread = threading.Thread(target=worker.loop, daemon=True)
+        worker_thread.start()
+
+        # before there's a snapshot, pings are answered and queries refused
+        worker_rx.put(((1, 'ping'), {}))
+        self.assertEqual(worker_tx.get(timeout=5), (1, 'pong'))
+        worker_rx.put(((2, 'query'), {'topic': ['topic1']}))
+        (task_id, error) = worker_tx.get(timeout=5)
+        self.assertEqual((task_id, error.status), (2, 503))
+
+        self.db_handler.SNAPSHOT_PATH = config['SNAPSHOT_PATH']
+        self.db_handler.snapshot()
+
+        # bad parameters and unsupported tasks get errors back
+        worker_rx.put(((3, 'query'), {'topic': ['topic1'], 'chunk': ['abc']}))
+        (task_id, error) = worker_tx.get(timeout=5)
+        self.assertIsInstance(error, TaskError)
+        self.assertEqual((task_id, error.status), (3, 400))
+        worker_rx.put(((4, 'profile'), {}))
+        self.assertEqual(worker_tx.get(timeout=5)[1].status, 501)
+
+        # slow queries are reported without being asked for
+        worker_rx.put(((5, 'query'), {'topic': ['topic1']}))
+        (task_id, (kind, record)) = worker_tx.get(timeout=5)
+        self.assertEqual((task_id, kind), (None, 'slow_query'))
+        self.assertEqual(record['params'], {'topic': ['topic1']})
+        self.assertEqual(worker_tx.get(timeout=5)[0], 5)
+
+        worker_rx.put(None)
+        worker_thread.join()
+
+    @patch('time.time')
+    def test_016_archive_fetches(self, mock_time):
+
+        logging.info('test_016_archive_fetches')
+
+        start_time = 1620000000
+        duration = 4 * 24 * 60 * 60
+
+        mock_time.return_value = start_time
+        self.reset_database_contents()
+
+        acc = Accumulator()
+        while mock_time() < (start_time + duration):
+            self.db_handler.insert('topic1', acc.get())
+            self.db_handler.insert('topic2', acc.get())
+            mock_time.return_value += 900
+
+        mirror = os.path.join(self.tempdir.name, 'mirror')
+        os.mkdir(mirror)
+        first_day = math.floor(start_time / self.config['S3_INTERVAL']) + 1
+        for day in range(first_day, first_day + 3):
+            self.db_handler.write_to_s3(day)
+        for (i, call) in enumerate(call for call in self.mock_s3_client.put_object.call_args_list if call[1]['Key'].endswith('.json.gz')):
+            # the first day is kept decompressed, as exports on the Pi are
+            if i == 0:
+                with open(os.path.join(mirror, os.path.basename(call[1]['Key'])[:-len('.gz')]), 'wb') as f:
+                    f.write(gzip.decompress(call[1]['Body']))
+            else:
+                with open(os.path.join(mirror, os.path.basename(call[1]['Key'])), 'wb') as f:
+                    f.write(call[1]['Body'])
+
+        mock_time.return_value = start_time + duration + self.config['RETENTION_PERIOD']
+        self.db_handler.trim_database()
+
+        config = dict(self.config, ARCHIVE_DIR=mirror, ARCHIVE_CACHE_DIR=os.path.join(self.tempdir.name, 'cache'), ARCHIVE_CACHE_DAYS=1)
+        db_handler = DatabaseHandler(self.task_queue, self.response_queue, self.mock_s3_client, config, False)
+        source = db_handler.archive.source
+        source.get = MagicMock(side_effect=source.get)
+
+        # queries without a since stay in memory
+        db_handler.handle_time_series({'topic': ['topic1', 'topic2']})
+        self.assertEqual(source.get.call_count, 0)
+
+        # each day is fetched once per query however many topics there are,
+        # even though the cache holds fewer days than the query spans
+        qsparams = {'topic': ['topic1', 'topic2'], 'chunk': [3600], 'since': [start_time - 1]}
+        result = db_handler.handle_time_series(qsparams)
+        self.assertEqual(len(result['topic1']), len(result['topic2']))
+        first_period_end = first_day * self.config['S3_INTERVAL']
+        self.assertTrue(any(bucket < first_period_end for (bucket, value) in result['topic1']))
+        fetched = [call[0][0] for call in source.get.call_args_list if call[0][0].endswith('.json.gz')]
+        self.assertEqual(len(fetched), len(set(fetched)))
+        self.assertEqual(len([f for f in os.listdir(config['ARCHIVE_CACHE_DIR']) if f.endswith('.db')]), 1)
+
+        # missing days are looked for again once MISSING_TTL has passed
+        markers = [f for f in os.listdir(config['ARCHIVE_CACHE_DIR']) if f.endswith('.missing')]
+        missing = [config['S3_PATH'] + f[:-len('.missing')] + '.json.gz' for f in markers]
+        self.assertGreater(len(missing), 0)
+        source.get.reset_mock()
+        db_handler.handle_time_series(qsparams)
+        self.assertNotIn(missing[0], [call[0][0] for call in source.get.call_args_list])
+        mock_time.return_value += db_handler.archive.MISSING_TTL
+        db_handler.handle_time_series(qsparams)
+        self.assertIn(missing[0], [call[0][0] for call in source.get.call_args_list])
+
+        # the HTTP server fetches the days a query needs up front, so the
+        # database thread only has to read them from the cache
+        config = dict(config, ARCHIVE_CACHE_DIR=os.path.join(self.tempdir.name, 'prefetched'), ARCHIVE_CACHE_DAYS=366)
+        httpd = HttpServer(None, None, None, config)
+        httpd.prefetch_archive({key: [str(value) for value in values] for (key, values) in qsparams.items()})
+        db_handler = DatabaseHandler(self.task_queue, self.response_queue, self.mock_s3_client, config, False)
+        db_handler.archive.source.get = MagicMock(side_effect=db_handler.archive.source.get)
+        self.assertEqual(db_handler.handle_time_series(qsparams), result)
+        self.assertEqual(db_handler.archive.source.get.call_count, 0)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,165 @@
+import unittest
+import json
+import queue
+import uuid
+import time
+import socket
+import logging
+import threading
+import urllib.request
+import urllib.error
+import os
+import tempfile
+from sensor_logging import DatabaseHandler, HttpServer, QueryWorker
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+class TestHttpServer(unittest.TestCase):
+    def start_server(self, config, query_rx=None, query_tx=None):
+        db_rx = queue.Queue()
+        db_tx = queue.Queue()
+
+        # the handler must be created on the thread that runs its loop
+        def start_db():
+            db = DatabaseHandler(db_rx, db_tx, None, config)
+            db.loop()
+
+        port = free_port()
+        httpd = HttpServer(port, db_rx, db_tx, config, query_rx, query_tx)
+        threading.Thread(target=start_db, daemon=True).start()
+        threading.Thread(target=httpd.start, daemon=True).start()
+
+        # wait for the server to come up
+        base = 'http://127.0.0.1:{}'.format(port)
+        for _ in range(50):
+            try:
+                urllib.request.urlopen(base + '/ping', timeout=5).read()
+                break
+            except (urllib.error.URLError, ConnectionError):
+                threading.Event().wait(0.1)
+        return base
+
+    def test_001_admin_disabled_by_default(self):
+        logging.info('test_001_admin_disabled_by_default')
+
+        base = self.start_server({})
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            urllib.request.urlopen(base + '/admin/slow-queries', timeout=5)
+        self.assertEqual(cm.exception.code, 404)
+
+    def test_002_admin_endpoints(self):
+        logging.info('test_002_admin_endpoints')
+
+        base = self.start_server({'ADMIN_ENABLED': True, 'SLOW_QUERY_THRESHOLD': 0})
+
+        urllib.request.urlopen(base + '/time-series?topic=topic1', timeout=15).read()
+        slow = json.loads(urllib.request.urlopen(base + '/admin/slow-queries', timeout=15).read())
+        self.assertEqual(len(slow), 1)
+        # without a since, none is passed on to the query
+        self.assertEqual(slow[0]['params'], {'topic': ['topic1'], 'chunk': [60]})
+
+        memory = json.loads(urllib.request.urlopen(base + '/admin/memory', timeout=15).read())
+        self.assertEqual(memory['used_bytes'], (memory['page_count'] - memory['freelist_count']) * memory['page_size'])
+
+        report = urllib.request.urlopen(base + '/admin/profile?seconds=0.5&limit=5', timeout=15).read().decode('utf-8')
+        self.assertIn('function calls', report)
+
+        report = urllib.request.urlopen(base + '/admin/tracemalloc?seconds=0.1&limit=5', timeout=15).read().decode('utf-8')
+        self.assertTrue(report.startswith('top 5 allocation changes'))
+
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            urllib.request.urlopen(base + '/admin/profile?sort=bogus', timeout=5)
+        self.assertEqual(cm.exception.code, 400)
+
+        for seconds in ('-1', '0', 'nan', 'inf'):
+            with self.assertRaises(urllib.error.HTTPError) as cm:
+                urllib.request.urlopen(base + '/admin/tracemalloc?seconds={}'.format(seconds), timeout=5)
+            self.assertEqual(cm.exception.code, 400)
+
+    def test_003_conditional_time_series(self):
+        logging.info('test_003_conditional_time_series')
+
+        # the in-memory database is shared with other tests, so use a topic of our own
+        topic = 'test/{}'.format(uuid.uuid4())
+        base = self.start_server({})
+        url = base + '/time-series?topic={}&chunk=60&since=0'.format(topic)
+
+        with urllib.request.urlopen(url, timeout=15) as response:
+            etag = response.headers['ETag']
+            self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+            self.assertEqual(json.loads(response.read()), {topic: []})
+        self.assertIsNotNone(etag)
+
+        request = urllib.request.Request(url, headers={'If-None-Match': etag})
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            urllib.request.urlopen(request, timeout=15)
+        self.assertEqual(cm.exception.code, 304)
+        self.assertEqual(cm.exception.headers['ETag'], etag)
+
+        # bad parameters get a 400 rather than a timeout
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            urllib.request.urlopen(base + '/time-series?topic={}&chunk=abc'.format(topic), timeout=15)
+        self.assertEqual(cm.exception.code, 400)
+
+        # windows that are over can be cached outright
+        with urllib.request.urlopen(url + '&until=60', timeout=15) as response:
+            self.assertTrue(response.headers['Cache-Control'].startswith('max-age='))
+
+    def test_004_admin_requests_dont_block(self):
+        logging.info('test_004_admin_requests_dont_block')
+
+        base = self.start_server({'ADMIN_ENABLED': True})
+        report = threading.Thread(target=lambda: urllib.request.urlopen(base + '/admin/tracemalloc?seconds=2', timeout=15).read())
+        report.start()
+        threading.Event().wait(0.2)
+
+        # other requests are answered while the report is running
+        start = time.monotonic()
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            urllib.request.urlopen(base + '/admin/tracemalloc?seconds=1', timeout=15)
+        self.assertEqual(cm.exception.code, 409)
+        self.assertEqual(urllib.request.urlopen(base + '/ping', timeout=15).read(), b'pong')
+        self.assertLess(time.monotonic() - start, 1.5)
+        report.join()
+
+        # as does a second profile while one is running
+        profile = threading.Thread(target=lambda: urllib.request.urlopen(base + '/admin/profile?seconds=1', timeout=15).read())
+        profile.start()
+        threading.Event().wait(0.2)
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            urllib.request.urlopen(base + '/admin/profile?seconds=1', timeout=15)
+        self.assertEqual(cm.exception.code, 409)
+        profile.join()
+
+    def test_005_worker_processes(self):
+        logging.info('test_005_worker_processes')
+
+        # a worker with no snapshot to read yet refuses queries, which shows
+        # they reach it while everything else goes to the database thread
+        snapshot_path = os.path.join(tempfile.mkdtemp(), 'snapshot.db')
+        config = {'ADMIN_ENABLED': True, 'WORKER_PROCESSES': 1, 'SNAPSHOT_PATH': snapshot_path}
+        query_rx = queue.Queue()
+        query_tx = queue.Queue()
+        worker = QueryWorker(query_rx, query_tx, None, config)
+        threading.Thread(target=worker.loop, daemon=True).start()
+        base = self.start_server({'ADMIN_ENABLED': True, 'WORKER_PROCESSES': 1}, query_rx, query_tx)
+
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            urllib.request.urlopen(base + '/time-series?topic=topic1', timeout=15)
+        self.assertEqual(cm.exception.code, 503)
+
+        self.assertEqual(urllib.request.urlopen(base + '/ping', timeout=15).read(), b'pong')
+        report = urllib.request.urlopen(base + '/admin/profile?seconds=0.5&limit=5', timeout=15).read().decode('utf-8')
+        self.assertIn('function calls', report)
+        memory = json.loads(urllib.request.urlopen(base + '/admin/memory', timeout=15).read())
+        self.assertIn('used_bytes', memory)
+
+        query_rx.put(None)
+
+if __name__ == '__main__':
+    unittest.main()